@@ -0,0 +1,205 @@
+import argparse
+import contextlib
+import io
+import json
+import os
+import shutil
+import tempfile
+import time
+
+import cv2
+import numpy as np
+
+from capture import SyntheticBackend, SyntheticWindow
+from run import AppUsageRecorder
+from config import load_config
+from supervisor import RecordingSupervisor
+
+# 截图流程基准：用合成截图源驱动 AppUsageRecorder，无需真实桌面
+# 统计整体帧率、写盘字节数，以及录制器记录的 截图 -> 去重 -> 编码写盘 各阶段耗时
+
+SCENARIOS = ("static", "widget", "scroll", "repaint")
+RESOLUTIONS = ("1280x720", "1920x1080", "3840x2160")
+
+
+def draw_ui(canvas, rng):
+    """ 画出类似应用界面的初始画面：色块、分隔线和文字 """
+    height, width = canvas.shape[:2]
+    canvas[:] = 245
+    canvas[:height // 12] = (60, 60, 60)  # 标题栏
+    canvas[:, :width // 6] = (230, 225, 220)  # 侧边栏
+    for row in range(height // 12 + 20, height - 20, 28):
+        x = width // 6 + 20
+        text = "".join(rng.choice(list("abcdefghijklmnopqrstuvwxyz  ")) for _ in range(60))
+        cv2.putText(canvas, text, (x, row), cv2.FONT_HERSHEY_SIMPLEX, 0.5, (30, 30, 30), 1, cv2.LINE_AA)
+
+
+def step_scene(scenario, canvas, window, step, rng):
+    """ 按场景修改画面，模拟一次界面变化 """
+    x, y, width, height = window.left, window.top, window.width, window.height
+    area = canvas[y:y + height, x:x + width]
+    if scenario == "static":
+        return
+    if scenario == "widget":
+        # 小控件（按钮、输入框）变化
+        wx = int(rng.integers(0, width - 160))
+        wy = int(rng.integers(0, height - 40))
+        area[wy:wy + 40, wx:wx + 160] = rng.integers(0, 255, 3)
+        cv2.putText(area, f"item {step}", (wx + 8, wy + 26), cv2.FONT_HERSHEY_SIMPLEX, 0.6, (0, 0, 0), 1)
+    elif scenario == "scroll":
+        # 内容向上滚动一行，底部出现新内容
+        area[:-28] = area[28:].copy()
+        area[-28:] = 245
+        text = "".join(rng.choice(list("abcdefghijklmnopqrstuvwxyz  ")) for _ in range(60))
+        cv2.putText(area, text, (20, height - 8), cv2.FONT_HERSHEY_SIMPLEX, 0.5, (30, 30, 30), 1, cv2.LINE_AA)
+    elif scenario == "repaint":
+        # 整个窗口重绘
+        area[:] = rng.integers(0, 255, 3)
+        for _ in range(20):
+            bx = int(rng.integers(0, width - 200))
+            by = int(rng.integers(0, height - 100))
+            area[by:by + 100, bx:bx + 200] = rng.integers(0, 255, 3)
+    else:
+        raise ValueError(f"未知的场景: {scenario}")
+
+
+class AnimatedBackend(SyntheticBackend):
+    """ 每次截取全屏前按场景修改画面，用于在目标进程中驱动多目标基准 """
+
+    def __init__(self, scenario, width, height, seed=0):
+        super().__init__(width, height)
+        self.scenario = scenario
+        self.rng = np.random.default_rng(seed)
+        self.window = SyntheticWindow(width // 10, height // 10, width * 4 // 5, height * 4 // 5)
+        self.step = 0
+        draw_ui(self.canvas, self.rng)
+
+    def grab(self, region=None, out=None):
+        if region is None:
+            step_scene(self.scenario, self.canvas, self.window, self.step, self.rng)
+            self.step += 1
+        return super().grab(region, out)
+
+
+def animated_backend(target, config):
+    """ RecordingSupervisor 的 backend_factory，在目标进程中创建动画截图源 """
+    width, height = (int(v) for v in target["resolution"].split("x"))
+    backend = AnimatedBackend(target["scenario"], width, height, seed=target["seed"])
+    return backend, backend.window
+
+
+def directory_size(path):
+    total = 0
+    for root, _, files in os.walk(path):
+        total += sum(os.path.getsize(os.path.join(root, name)) for name in files)
+    return total
+
+
+def run_case(config, scenario, resolution, frames, output_dir, seed=0):
+    """ 运行一个场景，返回统计结果 """
+    width, height = (int(v) for v in resolution.split("x"))
+    rng = np.random.default_rng(seed)
+    backend = SyntheticBackend(width, height)
+    draw_ui(backend.canvas, rng)
+    window = SyntheticWindow(width // 10, height // 10, width * 4 // 5, height * 4 // 5)
+
+    case_dir = os.path.join(output_dir, f"{scenario}_{resolution}")
+    case_config = dict(config, base_save_path=case_dir)
+    recorder = AppUsageRecorder(window, "bench", case_config, backend=backend)
+
+    start = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        for step in range(frames):
+            step_scene(scenario, backend.canvas, window, step, rng)
+            recorder.take_screenshot("基准")
+        recorder.close()  # 写完剩余截图并关闭截图后端、存储和预览
+    elapsed = time.perf_counter() - start
+
+    written = directory_size(case_dir)
+    return {
+        "scenario": scenario,
+        "resolution": resolution,
+        "frames": frames,
+        "saved": recorder.collection_count,
+        "fps": frames / elapsed,
+        "bytes_written": written,
+        "bytes_per_saved": written / max(1, recorder.collection_count),
+        "stages_ms": recorder.metrics.snapshot()["stages_ms"],  # 录制器自带的分阶段计时
+        "dedup_stats": dict(recorder.dedup.stats),
+        "writer_stats": dict(recorder.writer.stats)
+    }
+
+
+def run_targets_case(config, scenario, resolution, frames, targets, output_dir):
+    """ 用 RecordingSupervisor 同时录制多个目标，返回每个目标的平均帧率 """
+    case_dir = os.path.join(output_dir, f"{scenario}_{resolution}_x{targets}")
+    case_config = dict(config, base_save_path=case_dir, single_grab=True)
+    supervisor = RecordingSupervisor(
+        [{"name": f"target_{i}", "scenario": scenario, "resolution": resolution, "seed": i} for i in range(targets)],
+        case_config,
+        backend_factory=animated_backend
+    )
+    with contextlib.redirect_stdout(io.StringIO()):
+        supervisor.start()
+        start = time.perf_counter()
+        for _ in range(frames):
+            for commands in supervisor.commands.values():
+                commands.put("基准")  # 不合并触发，每个目标都截满 frames 次
+        supervisor.close()
+    elapsed = time.perf_counter() - start
+    return {
+        "scenario": scenario,
+        "resolution": resolution,
+        "targets": targets,
+        "frames": frames,
+        "saved": sum(stats["saved"] for stats in supervisor.stats.values()),
+        "fps_per_target": frames / elapsed,
+        "bytes_written": directory_size(case_dir)
+    }
+
+
+def print_result(result):
+    print(f"[{result['scenario']} {result['resolution']}] "
+          f"{result['fps']:.1f} 帧/秒, 保存 {result['saved']}/{result['frames']}, "
+          f"写盘 {result['bytes_written'] / 1e6:.2f} MB ({result['bytes_per_saved'] / 1e3:.1f} KB/张)")
+    for stage, values in result["stages_ms"].items():
+        print(f"    {stage:<16} p50 {values['p50']:8.2f} ms  p95 {values['p95']:8.2f} ms  p99 {values['p99']:8.2f} ms  (n={values['count']})")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="截图流程基准测试（合成截图源）")
+    parser.add_argument("--scenarios", default=",".join(SCENARIOS), help="逗号分隔的场景: " + ", ".join(SCENARIOS))
+    parser.add_argument("--resolutions", default=",".join(RESOLUTIONS[:2]), help="逗号分隔的分辨率，如 1920x1080")
+    parser.add_argument("--frames", type=int, default=60, help="每个场景的截图次数")
+    parser.add_argument("--output", help="截图输出目录，默认使用临时目录并在结束后删除")
+    parser.add_argument("--json", help="把结果写入 JSON 文件")
+    parser.add_argument("--targets", type=int, default=0, help="大于 0 时用 supervisor.py 同时录制多个目标，对比单目标和多目标的每目标帧率")
+    args = parser.parse_args()
+
+    config = load_config()
+    output_dir = args.output or tempfile.mkdtemp(prefix="screen_shot_bench_")
+    results = []
+    try:
+        for resolution in args.resolutions.split(","):
+            for scenario in args.scenarios.split(","):
+                if args.targets:
+                    for targets in sorted({1, args.targets}):
+                        result = run_targets_case(config, scenario, resolution, args.frames, targets, output_dir)
+                        print(f"[{scenario} {resolution} x{targets}] 每个目标 {result['fps_per_target']:.1f} 帧/秒, "
+                              f"保存 {result['saved']}/{result['frames'] * targets}")
+                        results.append(result)
+                    continue
+                result = run_case(config, scenario, resolution, args.frames, output_dir)
+                print_result(result)
+                results.append(result)
+    finally:
+        if not args.output:
+            shutil.rmtree(output_dir, ignore_errors=True)
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=4)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,145 @@
+from contextlib import nullcontext
+
+import numpy as np
+import cv2
+
+# 截图后端：把屏幕像素直接写入可复用的 NumPy 缓冲区，避免 PIL -> np.array -> cvtColor 的多次整帧拷贝
+# 所有后端返回 BGR uint8 帧；不传 out 时返回的是后端内部缓冲区，下一次同尺寸的同类 grab（窗口 / 全屏）会覆盖它
+
+
+class CaptureBackend:
+    """ 截图后端基类 """
+
+    def __init__(self):
+        self._buffers = {}
+        self.metrics = None  # 设置为 metrics.Metrics 后记录 grab / color 阶段耗时
+
+    def _stage(self, name):
+        return self.metrics.stage(name) if self.metrics is not None else nullcontext()
+
+    def _buffer(self, width, height, full_screen):
+        """ 按尺寸复用输出缓冲区；窗口和全屏各用一组，窗口与屏幕一样大时全屏截图不会覆盖刚返回的窗口截图 """
+        key = (full_screen, width, height)
+        buffer = self._buffers.get(key)
+        if buffer is None:
+            buffer = np.empty((height, width, 3), dtype=np.uint8)
+            self._buffers[key] = buffer
+        return buffer
+
+    def screen_area(self):
+        """ 返回全屏区域 (x, y, width, height) """
+        raise NotImplementedError
+
+    def grab(self, region=None, out=None):
+        """ 截取 region=(x, y, width, height)，region 为 None 时截取全屏 """
+        raise NotImplementedError
+
+    def close(self):
+        pass
+
+
+class MssBackend(CaptureBackend):
+    """ 基于 mss 的截图后端（Linux 下走 X11 共享内存），BGRA 原始数据直接转换进缓冲区 """
+
+    def __init__(self, monitor=1):
+        super().__init__()
+        import mss
+        self._sct = mss.mss()
+        self._monitor = self._sct.monitors[monitor]  # 0 为所有显示器拼接，1 为主显示器
+
+    def screen_area(self):
+        return (self._monitor["left"], self._monitor["top"], self._monitor["width"], self._monitor["height"])
+
+    def grab(self, region=None, out=None):
+        x, y, width, height = region if region is not None else self.screen_area()
+        with self._stage("grab"):
+            shot = self._sct.grab({"left": x, "top": y, "width": width, "height": height})
+        bgra = np.frombuffer(shot.raw, dtype=np.uint8).reshape(shot.height, shot.width, 4)  # 零拷贝视图
+        if out is None:
+            out = self._buffer(shot.width, shot.height, region is None)
+        with self._stage("color"):
+            cv2.cvtColor(bgra, cv2.COLOR_BGRA2BGR, dst=out)
+        return out
+
+    def close(self):
+        self._sct.close()
+
+
+class PyAutoGuiBackend(CaptureBackend):
+    """ 基于 pyautogui 的截图后端，mss 不可用时的兜底方案 """
+
+    def __init__(self):
+        super().__init__()
+        import pyautogui
+        self._pyautogui = pyautogui
+
+    def screen_area(self):
+        width, height = self._pyautogui.size()
+        return (0, 0, width, height)
+
+    def grab(self, region=None, out=None):
+        with self._stage("grab"):
+            screenshot = self._pyautogui.screenshot(region=region)
+            rgb = np.asarray(screenshot)
+        if out is None:
+            out = self._buffer(rgb.shape[1], rgb.shape[0], region is None)
+        with self._stage("color"):
+            cv2.cvtColor(rgb, cv2.COLOR_RGB2BGR, dst=out)
+        return out
+
+
+class SyntheticBackend(CaptureBackend):
+    """ 合成截图源，用于无桌面环境的测试和基准；调用方直接修改 canvas 来模拟界面变化 """
+
+    def __init__(self, width=1920, height=1080):
+        super().__init__()
+        self.canvas = np.full((height, width, 3), 240, dtype=np.uint8)
+
+    def screen_area(self):
+        return (0, 0, self.canvas.shape[1], self.canvas.shape[0])
+
+    def grab(self, region=None, out=None):
+        x, y, width, height = region if region is not None else self.screen_area()
+        if x < 0 or y < 0 or x + width > self.canvas.shape[1] or y + height > self.canvas.shape[0]:
+            raise ValueError(f"截图区域超出屏幕: {(x, y, width, height)}")
+        if out is None:
+            out = self._buffer(width, height, region is None)
+        with self._stage("grab"):
+            np.copyto(out, self.canvas[y:y + height, x:x + width])
+        return out
+
+
+class SyntheticWindow:
+    """ 与 pygetwindow 窗口接口一致的固定窗口，配合 SyntheticBackend 使用 """
+
+    def __init__(self, left, top, width, height, title="synthetic"):
+        self.left = left
+        self.top = top
+        self.width = width
+        self.height = height
+        self.title = title
+        self.isMinimized = False
+        self.isActive = True
+
+    def activate(self):
+        self.isActive = True
+
+    def restore(self):
+        self.isMinimized = False
+
+
+def create_backend(name="auto", monitor=1):
+    """ 根据配置名称创建截图后端: auto / mss / pyautogui / synthetic """
+    if name == "auto":
+        try:
+            return MssBackend(monitor)
+        except ImportError:
+            print("未安装 mss，使用 pyautogui 截图")
+            return PyAutoGuiBackend()
+    if name == "mss":
+        return MssBackend(monitor)
+    if name == "pyautogui":
+        return PyAutoGuiBackend()
+    if name == "synthetic":
+        return SyntheticBackend()
+    raise ValueError(f"未知的截图后端: {name}")
@@ -0,0 +1,190 @@
+import os
+import sys
+import hashlib
+import argparse
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+
+import cv2
+import numpy as np
+
+from dedup import batched_ssim, dhash, hamming, resize_to_width
+from session import init_worker, open_session, worker_session
+from config import load_config
+
+# 整个录制目录的近重复压缩
+# 录制时只和最近 k 张比较，回到同一个菜单等反复出现的界面会被重复保存
+# 1. 进程池并行计算每张 cap_full_image 的 dHash（按 JPEG 缩小解码，很快）和文件摘要
+# 2. 按 image_id 顺序聚类：代表帧的 dHash 放进 BK 树，只对汉明距离不超过 dedup_hash_distance 的代表帧
+#    在工作分辨率下计算 SSIM，超过 threshold 即为近重复
+# 3. 默认在重复截图的元数据中写入 duplicate_of（代表帧的 image_id），--drop 时直接删除重复截图
+
+MAX_CANDIDATES = 8  # 每张截图最多与多少个最接近的代表帧比较 SSIM
+REDUCED_GRAYSCALE = ((8, cv2.IMREAD_REDUCED_GRAYSCALE_8), (4, cv2.IMREAD_REDUCED_GRAYSCALE_4), (2, cv2.IMREAD_REDUCED_GRAYSCALE_2))
+
+
+class BKTree:
+    """ 按汉明距离组织的 BK 树，查询半径 r 内的元素不需要遍历全部节点 """
+
+    def __init__(self):
+        self.root = None  # [hash, value, {距离: 子节点}]
+        self.size = 0
+
+    def add(self, key, value):
+        self.size += 1
+        if self.root is None:
+            self.root = [key, value, {}]
+            return
+        node = self.root
+        while True:
+            distance = hamming(key, node[0])
+            child = node[2].get(distance)
+            if child is None:
+                node[2][distance] = [key, value, {}]
+                return
+            node = child
+
+    def query(self, key, radius):
+        """ 返回 [(距离, value)]，按距离从小到大排序 """
+        found = []
+        stack = [self.root] if self.root is not None else []
+        while stack:
+            node = stack.pop()
+            distance = hamming(key, node[0])
+            if distance <= radius:
+                found.append((distance, node[1]))
+            # 三角不等式：只有与当前节点距离在 [d - r, d + r] 内的子树可能包含结果
+            for child_distance, child in node[2].items():
+                if distance - radius <= child_distance <= distance + radius:
+                    stack.append(child)
+        return sorted(found, key=lambda item: item[0])
+
+
+def hash_captures(image_ids):
+    """ 进程池中执行：返回 [(image_id, 文件名, 摘要, dHash, 缩小尺寸, 是否已裁剪)]
+    没有完整截图的和上一次压缩已经标记过的跳过 """
+    session = worker_session()
+    results = []
+    for image_id in image_ids:
+        name = session.find(image_id, 'cap_full_image')
+        if name is None:
+            continue  # 增量截图需要先运行 delta.py 恢复
+        meta = session.read_meta(image_id)
+        if meta.get("duplicate_of"):
+            continue
+        data = session.read_bytes(image_id, name)
+        gray = cv2.imdecode(np.frombuffer(data, dtype=np.uint8), cv2.IMREAD_REDUCED_GRAYSCALE_4)
+        if gray is None:
+            continue
+        results.append((image_id, name, hashlib.blake2b(data, digest_size=16).digest(), dhash(gray), gray.shape, "crop_area_rel" in meta))
+    return results
+
+
+class Compactor:
+    """ 顺序聚类，维护代表帧的 BK 树和工作分辨率灰度图缓存 """
+
+    def __init__(self, session, threshold, hash_distance=10, working_width=960, cache_bytes=256 * 1024 * 1024):
+        self.session = session
+        self.threshold = threshold
+        self.hash_distance = hash_distance
+        self.working_width = working_width
+        self.cache_bytes = cache_bytes  # 0 表示不限制
+        self.trees = {}     # 缩小尺寸 -> BKTree，不同尺寸的截图不可能重复
+        self.digests = {}   # 文件摘要 -> 代表帧，完全相同的图片不需要计算 SSIM
+        self.names = {}     # 代表帧 -> 文件名
+        self._cache = OrderedDict()
+        self._cached = 0
+        self.stats = {"exact": 0, "ssim": 0, "compared": 0}
+
+    def work_image(self, image_id, name, shape):
+        """ 代表帧的工作分辨率灰度图，按 LRU 缓存在内存预算内
+        shape 为 1/4 缩小解码的尺寸；与 preview.render 一样，JPEG 按 1/2、1/4、1/8 缩小解码，只要宽度不小于工作分辨率 """
+        work = self._cache.get(image_id)
+        if work is not None:
+            self._cache.move_to_end(image_id)
+            return work
+        width = shape[1] * 4 - 3  # 缩小解码的尺寸向上取整，原图宽度至少为此值
+        flag = cv2.IMREAD_GRAYSCALE
+        for factor, reduced in REDUCED_GRAYSCALE:
+            if self.working_width and -(-width // factor) >= self.working_width:
+                flag = reduced
+                break
+        data = self.session.read_bytes(image_id, name)
+        work = resize_to_width(cv2.imdecode(np.frombuffer(data, dtype=np.uint8), flag), self.working_width)
+        self._cache[image_id] = work
+        self._cached += work.nbytes
+        while self.cache_bytes and self._cached > self.cache_bytes and len(self._cache) > 1:
+            _, old = self._cache.popitem(last=False)
+            self._cached -= old.nbytes
+        return work
+
+    def assign(self, image_id, name, digest, hash_value, shape):
+        """ 返回重复截图对应的代表帧，不重复时加入代表帧并返回 None """
+        representative = self.digests.get(digest)
+        if representative is not None:
+            self.stats["exact"] += 1
+            return representative
+
+        tree = self.trees.setdefault(shape, BKTree())
+        candidates = [rep for _, rep in tree.query(hash_value, self.hash_distance)[:MAX_CANDIDATES]]
+        if candidates:
+            current = self.work_image(image_id, name, shape)
+            stack = np.stack([self.work_image(rep, self.names[rep], shape) for rep in candidates])
+            self.stats["compared"] += len(candidates)
+            scores = batched_ssim(stack, current)
+            best = int(np.argmax(scores))
+            if scores[best] > self.threshold:
+                self.stats["ssim"] += 1
+                return candidates[best]
+
+        tree.add(hash_value, image_id)
+        self.digests[digest] = image_id
+        self.names[image_id] = name
+        return None
+
+
+def compact(app_dir, config, drop=False, workers=None, chunk=256):
+    """ 压缩录制目录，返回 {重复截图: 代表帧} """
+    session = open_session(app_dir)
+    image_ids = session.image_ids()
+    workers = workers or os.cpu_count() or 1
+    chunks = [image_ids[i:i + chunk] for i in range(0, len(image_ids), chunk)]
+    with ProcessPoolExecutor(max_workers=workers, initializer=init_worker, initargs=(app_dir,)) as pool:
+        hashes = [item for result in pool.map(hash_captures, chunks) for item in result]
+    print(f"已计算 {len(hashes)} 张截图的哈希")
+
+    compactor = Compactor(
+        session,
+        config["threshold"],
+        hash_distance=config["dedup_hash_distance"],
+        working_width=config["dedup_working_width"],
+        cache_bytes=int(config["dedup_memory_budget_mb"] * 1024 * 1024)
+    )
+    duplicates = {}
+    for image_id, name, digest, hash_value, shape, cropped in hashes:
+        representative = compactor.assign(image_id, name, digest, hash_value, shape)
+        if representative is None:
+            continue
+        duplicates[image_id] = representative
+        if drop and not cropped:  # 已经裁剪过的截图只标记不删除
+            session.delete(image_id)
+        else:
+            session.update_meta(image_id, {"duplicate_of": representative})
+
+    print(f"代表帧 {sum(tree.size for tree in compactor.trees.values())} 张, 重复 {len(duplicates)} 张 "
+          f"(完全相同 {compactor.stats['exact']}, SSIM {compactor.stats['ssim']}, 共比较 {compactor.stats['compared']} 次)")
+    session.close()
+    return duplicates
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="合并整个录制目录中反复出现的近重复截图")
+    parser.add_argument("app_dir", help="录制目录，即 ./[base_save_path]/[app_name]")
+    parser.add_argument("--drop", action="store_true", help="删除重复截图（默认只在元数据中写入 duplicate_of）")
+    parser.add_argument("--workers", type=int, help="计算哈希的进程数，默认使用全部 CPU")
+    args = parser.parse_args()
+
+    if not os.path.isdir(args.app_dir):
+        print(f"目录不存在: {args.app_dir}")
+        sys.exit(1)
+    compact(args.app_dir, load_config(), drop=args.drop, workers=args.workers)
@@ -0,0 +1,63 @@
+import yaml
+
+# 录制配置：默认值和 config.yaml 的读取
+# 单独成一个模块，进程池中的工作进程（ingest.py、compact.py 等）不需要导入 run.py 的 tkinter / keyboard / mouse
+
+CONFIG_FILE = "config.yaml"
+
+DEFAULT_CONFIG = {
+    "base_save_path": "screenshots",
+    "azure_sas_url": "",
+    "container_name": "",
+    "threshold": 0.995,
+    "upload_to_cloud": False,
+    "capture_mode": "auto",
+    "auto_screenshot_interval": 0.5, # x秒没有截屏就自动截屏
+    "min_screenshot_interval": 0.1,  # 最短的截屏间隔是y秒
+    "recent_screenshots_count": 5,   # 最近的k张截图，0 表示只受 dedup_memory_budget_mb 限制
+    "jpeg_quality": 100,              # JPEG压缩质量（0-100）
+    "area_codec": {},                 # 应用截图的编码设置，未设置的字段使用默认值（见 imagecodec.py）
+    "full_codec": {},                 # 全屏截图的编码设置
+    "capture_backend": "auto",        # 截图后端: auto / mss / pyautogui / synthetic
+    "capture_monitor": 1,             # mss 使用的显示器编号，0 为所有显示器
+    "single_grab": True,              # 每次只截一次全屏，窗口截图取全屏帧上的视图
+    "dedup_hash_distance": 10,        # dHash 汉明距离超过该值直接判定为不重复
+    "dedup_small_diff": 2.0,          # 缩略图平均灰度差超过该值直接判定为不重复
+    "dedup_working_width": 960,       # 批量计算 SSIM 的工作分辨率宽度，0 为原分辨率
+    "dedup_early_exit": True,         # 发现重复立即停止，关闭后比较完所有历史截图（都分批计算）
+    "dedup_memory_budget_mb": 64,     # 去重历史占用的内存上限（MB），0 为不限制
+    "writer_workers": 2,              # 后台编码写盘的线程数
+    "writer_queue_size": 8,           # 写入队列长度
+    "writer_policy": "block",         # 写入队列满时: block 阻塞截图 / drop 丢弃截图
+    "delta_storage": False,           # 非关键帧只保存变化区域
+    "keyframe_interval": 30,          # 增量存储时每隔多少张截图保存一次完整关键帧
+    "metrics_file": "metrics.jsonl",  # 各阶段耗时写入录制目录下的该文件，留空则不写
+    "metrics_interval": 10,           # 写入耗时统计的间隔（秒）
+    "metrics_port": 0,                # 大于 0 时在本地端口提供 Prometheus 文本格式的 /metrics
+    "storage_format": "dir",          # dir: 每张截图一个目录 / pack: 追加写入单个打包文件
+    "record_previews": False,         # 写入线程顺带生成预览金字塔（见 preview.py）
+    "preview_levels": [1920, 960, 480, 240],  # 预览各级的长边像素
+    "preview_quality": 85,            # 预览的 JPEG 质量
+    "upload_workers": 4,              # 并行上传的线程数
+    "upload_max_retries": 5,          # 单个文件上传失败后的最大重试次数
+    "upload_block_concurrency": 4,    # 单个大文件按块并行上传的并发数
+    "upload_local_dir": ""            # 非空时上传到该本地目录（代替云存储，便于测试）
+}
+
+# 加载和保存配置
+def load_config():
+    try:
+        with open(CONFIG_FILE, "r") as file: # yaml
+            config = yaml.safe_load(file) or {}
+            return {**DEFAULT_CONFIG, **config}  # 旧配置文件缺少的新字段使用默认值
+            
+    except FileNotFoundError:
+        default_config = dict(DEFAULT_CONFIG)
+        with open(CONFIG_FILE, "w") as file:
+            yaml.dump(default_config, file)
+        return default_config
+
+def clean_folder_name(name):
+    """ 去掉文件夹名称中的中文字符、不合法的字符和空格 """
+    name = ''.join([i for i in name if not '\u4e00' <= i <= '\u9fff'])
+    return name.replace("\\", "_").replace("/", "_").replace(":", "_").replace("*", "_").replace("?", "_").replace('"', "_").replace("<", "_").replace(">", "_").replace("|", "_").removeprefix(" ").removesuffix(" ").replace(" ", "_")
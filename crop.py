@@ -1,12 +1,115 @@
 import os
-import json
+import time
+import queue
+import threading
 import tkinter as tk
 from tkinter import filedialog, messagebox
-from PIL import Image, ImageTk
+from PIL import ImageTk
+
+from session import open_session
+from prefetch import ImagePrefetcher, fit_size, load_scaled
+from preview import PREVIEW_DIR, PreviewStore
+
+PREFETCH_RADIUS = 3  # 预读当前图片前后各几张
 
 # image_meta.json
 # cap_full_image.jpg
 # cap_area_image.jpg
+# 确认裁剪时只记录坐标 crop_area_rel / crop_area_abs，crop_image.jpg 由 materialize.py 或 merge.py 之后批量生成
+
+_STOP = object()
+
+
+class MetaBatcher:
+    """ 后台线程合并写入元数据更新，界面线程只入队；第一条更新到达后最多等待 delay 秒凑成一批 """
+
+    def __init__(self, session, batch_size=64, delay=0.5):
+        self.session = session
+        self.batch_size = batch_size
+        self.delay = delay
+        self.queue = queue.Queue()
+        self._thread = threading.Thread(target=self._worker, name="meta-batcher", daemon=True)
+        self._thread.start()
+
+    def submit(self, image_id, updates):
+        self.queue.put((image_id, updates))
+
+    def _worker(self):
+        stopped = False
+        while not stopped:
+            item = self.queue.get()
+            batch = {}
+            deadline = time.monotonic() + self.delay
+            while True:
+                if item is _STOP:
+                    stopped = True
+                    break
+                batch.setdefault(item[0], {}).update(item[1])
+                if len(batch) >= self.batch_size:
+                    break
+                try:
+                    item = self.queue.get(timeout=max(0, deadline - time.monotonic()))
+                except queue.Empty:
+                    break
+            if batch:
+                try:
+                    self.session.update_metas(batch)
+                except Exception as e:
+                    print(f"元数据写入失败: {e}")
+
+    def close(self):
+        """ 写完队列中剩余的更新 """
+        self.queue.put(_STOP)
+        self._thread.join()
+
+
+
+class SessionIndex:
+    """ 录制目录的截图索引：一次读取全部元数据（dir 格式由 .meta_manifest.json 缓存），之后只合并新出现的截图
+    不再逐个列出截图目录；compact.py 标记为重复（duplicate_of）的截图不参与裁剪 """
+
+    def __init__(self, session):
+        self.session = session
+        self.image_ids = []   # 可以裁剪的截图，按 image_id 排序
+        self.cropped = set()  # 元数据中已有 crop_area_rel 的截图
+        self.proposals = {}   # propose.py 生成的裁剪建议 crop_proposal_rel
+        self.origins = {}     # cap_full 左上角的屏幕坐标，用于计算 crop_area_abs
+        self.legacy_crops = set()  # 裁剪过但没有 crop_image_rel 的截图（旧版 crop.py 直接保存了 crop_image.jpg）
+        self._known = set()   # 已经处理过的 image_id（包括跳过的）
+
+    def refresh(self):
+        """ 合并上次之后新增的截图（录制可能仍在进行），返回新增数量 """
+        added = []
+        for image_id, meta in self.session.metas().items():
+            if image_id in self._known:
+                continue
+            if 'delta_files' in meta and not self.session.find(image_id, 'cap_full_image'):
+                continue  # 增量截图运行 delta.py 恢复后下次刷新再加入
+            self._known.add(image_id)
+            if meta.get('duplicate_of'):
+                continue
+            added.append(image_id)
+            self.origins[image_id] = meta['cap_full'][:2]
+            if 'crop_area_rel' in meta:
+                self.cropped.add(image_id)
+                if 'crop_image_rel' not in meta:
+                    self.legacy_crops.add(image_id)
+            if 'crop_proposal_rel' in meta:
+                self.proposals[image_id] = meta['crop_proposal_rel']
+        if added:
+            self.image_ids = sorted(self.image_ids + added)
+        return len(added)
+
+    def mark_cropped(self, image_id):
+        self.cropped.add(image_id)
+
+    def first_uncropped(self, start=0):
+        """ 从 start 开始第一张还没有裁剪的截图的位置，全部裁剪过时返回 None """
+        for index in range(start, len(self.image_ids)):
+            if self.image_ids[index] not in self.cropped:
+                return index
+        return None
+
 
 class ImageCropperApp:
     def __init__(self):
@@ -16,10 +119,17 @@ class ImageCropperApp:
         
         # 初始化状态
         self.app_dir = None
-        self.image_dirs = []
+        self.session = None  # 目录格式或 pack 格式的录制结果
+        self.prefetcher = None  # 后台解码缩放前后几张图片
+        self.previews = None  # 预览金字塔（运行过 preview.py 或录制时开启 record_previews）
+        self.index = None  # 截图索引，记录哪些截图已经裁剪
+        self.meta_batcher = None  # 后台批量写入裁剪坐标
+        self.image_ids = []
         self.current_index = -1  # 初始为-1表示未选择
         self.rect_start = None
         self.rect_end = None
+        self.proposal = None  # 当前显示的裁剪建议 (画布上的矩形, 原图坐标)
+        self.original_size = None  # 当前图片的原图尺寸
         
         # 创建界面
         self.create_widgets()
@@ -70,29 +180,64 @@ class ImageCropperApp:
             self.app_dir = selected_dir
             self.dir_label.config(text=selected_dir)
             self.load_image_dirs()
-            self.current_index = 0  # 初始化索引
+            # 从第一张还没有裁剪的截图继续
+            resume = self.index.first_uncropped()
+            self.current_index = resume if resume is not None else 0
             self.show_current_image()
             self.update_controls()
 
     def load_image_dirs(self):
-        """加载所有有效的image_id目录"""
-        self.image_dirs = []
-        for dir_name in sorted(os.listdir(self.app_dir)):
-            dir_path = os.path.join(self.app_dir, dir_name)
-            if os.path.isdir(dir_path):
-                required_files = {'cap_full_image.jpg', 'image_meta.json'}
-                if required_files.issubset(os.listdir(dir_path)):
-                    self.image_dirs.append(dir_path)
+        """加载所有有效的image_id"""
+        if self.prefetcher is not None:
+            self.prefetcher.close()
+        if self.meta_batcher is not None:
+            self.meta_batcher.close()
+        if self.session is not None:
+            self.session.close()
+        if self.previews is not None:
+            self.previews.close()
+        self.session = open_session(self.app_dir)
+        has_previews = os.path.exists(os.path.join(self.app_dir, PREVIEW_DIR, 'session.idx'))
+        self.previews = PreviewStore(self.app_dir) if has_previews else None
+        self.index = SessionIndex(self.session)
+        self.index.refresh()
+        self.image_ids = self.index.image_ids
+        self.prefetcher = ImagePrefetcher(self.load_display_image, capacity=4 * PREFETCH_RADIUS + 2)
+        self.meta_batcher = MetaBatcher(self.session)
+
+    def load_display_image(self, image_id, size):
+        """在预读线程中执行：优先使用合适的一级预览，否则缩小解码原图，再缩放到画布尺寸"""
+        name = self.session.find(image_id, 'cap_full_image')
+        if self.previews is not None:
+            key = f"{image_id}/{name}"
+            version = self.session.version(image_id, name)
+            original_size = self.previews.original_size(key, version)
+            if original_size is not None:
+                target = fit_size(original_size, size)
+                found = self.previews.open_scale(key, target[0] / original_size[0], version)
+                if found is not None:
+                    return found[0].resize(target), original_size
+        return load_scaled(self.session, image_id, name, size)
+
+    def canvas_size(self):
+        return max(1, self.canvas.winfo_width() - 20), max(1, self.canvas.winfo_height() - 20)
 
     def show_current_image(self):
         """显示当前目录的图像"""
-        if 0 <= self.current_index < len(self.image_dirs):
-            current_dir = self.image_dirs[self.current_index]
-            img_path = os.path.join(current_dir, 'cap_full_image.jpg')
+        if 0 <= self.current_index < len(self.image_ids):
+            image_id = self.image_ids[self.current_index]
            
             try:
-                img = Image.open(img_path)
-                self.display_image(img)
+                size = self.canvas_size()
+                img, original_size = self.prefetcher.get(image_id, size)
+                self.display_image(img, original_size)
+                if image_id not in self.index.cropped and image_id in self.index.proposals:
+                    self.show_proposal(self.index.proposals[image_id])
+                # 先预读下一张（最常用的方向），再交替预读前后
+                neighbors = []
+                for offset in range(1, PREFETCH_RADIUS + 1):
+                    neighbors += [self.current_index + offset, self.current_index - offset]
+                self.prefetcher.prefetch([self.image_ids[i] for i in neighbors if 0 <= i < len(self.image_ids)], size)
                 self.update_controls()
                 self.update_progress()
             except Exception as e:
@@ -101,27 +246,34 @@ class ImageCropperApp:
         else:
             messagebox.showinfo("提示", "没有更多目录可处理")
 
-    def display_image(self, image):
-        """调整并显示图像"""
-        # 计算显示尺寸
-        canvas_width = self.canvas.winfo_width() - 20
-        canvas_height = self.canvas.winfo_height() - 20
-        img_width, img_height = image.size
-       
-        scale = min(canvas_width/img_width,
-                   canvas_height/img_height)
-        new_size = (int(img_width*scale), int(img_height*scale))
+    def display_image(self, image, original_size):
+        """显示已经缩放到画布尺寸的图像"""
+        img_width, img_height = original_size
+        self.original_size = original_size
+        new_size = image.size
         
         # 保存缩放比例用于坐标转换
         self.scale_x = img_width / new_size[0]
         self.scale_y = img_height / new_size[1]
         
         # 显示图像
-        self.tk_image = ImageTk.PhotoImage(image.resize(new_size))
+        self.tk_image = ImageTk.PhotoImage(image)
         self.canvas.delete("all")
         self.canvas.create_image(10, 10, anchor=tk.NW, image=self.tk_image)
         self.rect_start = None
         self.rect_end = None
+        self.proposal = None
+
+    def show_proposal(self, rect):
+        """预先画出裁剪建议，直接确认即可"""
+        x, y, w, h = rect
+        # 图像画在画布的 (10, 10) 处
+        self.rect_start = (10 + x / self.scale_x, 10 + y / self.scale_y)
+        self.rect_end = (10 + (x + w) / self.scale_x, 10 + (y + h) / self.scale_y)
+        self.proposal = ((self.rect_start, self.rect_end), (x, y, x + w, y + h))
+        self.canvas.create_rectangle(self.rect_start[0], self.rect_start[1],
+                                   self.rect_end[0], self.rect_end[1],
+                                   outline='#FF8800', width=2, dash=(6, 3), tags="rect")
 
     def start_rect(self, event):
         """开始绘制矩形"""
@@ -151,26 +303,27 @@ class ImageCropperApp:
             messagebox.showwarning("警告", "请先选择区域！")
             return
             
-        # 计算实际坐标
-        x0 = int(min(self.rect_start[0], self.rect_end[0]) * self.scale_x)
-        y0 = int(min(self.rect_start[1], self.rect_end[1]) * self.scale_y)
-        x1 = int(max(self.rect_start[0], self.rect_end[0]) * self.scale_x)
-        y1 = int(max(self.rect_start[1], self.rect_end[1]) * self.scale_y)
-
-        # 保存裁剪图像
-        current_dir = self.image_dirs[self.current_index]
-        img_path = os.path.join(current_dir, 'cap_full_image.jpg')
-    
-        try:
-            img = Image.open(img_path)
-            crop_img = img.crop((x0, y0, x1, y1))
-            crop_img.save(os.path.join(current_dir, 'crop_image.jpg'), quality=95)
-            
-            # 更新元数据
-            self.update_metadata(current_dir, x0, y0, x1, y1)
-            self.next_image()
-        except Exception as e:
-            messagebox.showerror("错误", f"保存失败: {str(e)}")
+        # 计算实际坐标，未修改的裁剪建议直接使用原图坐标
+        if self.proposal is not None and self.proposal[0] == (self.rect_start, self.rect_end):
+            x0, y0, x1, y1 = self.proposal[1]
+        else:
+            x0 = int(min(self.rect_start[0], self.rect_end[0]) * self.scale_x)
+            y0 = int(min(self.rect_start[1], self.rect_end[1]) * self.scale_y)
+            x1 = int(max(self.rect_start[0], self.rect_end[0]) * self.scale_x)
+            y1 = int(max(self.rect_start[1], self.rect_end[1]) * self.scale_y)
+            # 拖到图片外的部分截掉，记录的坐标与生成的裁剪图片尺寸一致
+            width, height = self.original_size
+            x0, x1 = max(0, min(x0, width)), max(0, min(x1, width))
+            y0, y1 = max(0, min(y0, height)), max(0, min(y1, height))
+            if x1 <= x0 or y1 <= y0:
+                messagebox.showwarning("警告", "选择的区域在图片之外！")
+                return
+
+        # 只记录坐标，裁剪图片之后批量生成
+        image_id = self.image_ids[self.current_index]
+        self.update_metadata(image_id, x0, y0, x1, y1)
+        self.index.mark_cropped(image_id)
+        self.next_image()
 
     def previous_image(self):
         """返回上一张图像"""
@@ -182,7 +335,9 @@ class ImageCropperApp:
 
     def next_image(self):
         """跳转到下一张图像"""
-        if self.current_index < len(self.image_dirs) - 1:
+        if self.current_index >= len(self.image_ids) - 1 and self.index.refresh():
+            self.image_ids = self.index.image_ids  # 录制期间新增的截图
+        if self.current_index < len(self.image_ids) - 1:
             self.current_index += 1
             self.show_current_image()
         else:
@@ -191,33 +346,33 @@ class ImageCropperApp:
 
     def update_controls(self):
         """更新控件状态"""
-        has_images = len(self.image_dirs) > 0
+        has_images = len(self.image_ids) > 0
         self.btn_prev.config(state=tk.NORMAL if self.current_index > 0 else tk.DISABLED)
         self.btn_confirm.config(state=tk.NORMAL if has_images else tk.DISABLED)
         self.btn_next.config(state=tk.NORMAL if has_images else tk.DISABLED)
 
     def update_progress(self):
         """更新进度显示"""
-        text = f"正在处理：{self.current_index + 1}/{len(self.image_dirs)}"
+        text = f"正在处理：{self.current_index + 1}/{len(self.image_ids)}（已裁剪 {len(self.index.cropped)}）"
         self.progress_label.config(text=text)
     
-    def update_metadata(self, dir_path, x0, y0, x1, y1):
-        """更新JSON元数据文件"""
-        meta_path = os.path.join(dir_path, 'image_meta.json')
-        with open(meta_path, 'r+') as f:
-            meta = json.load(f)
-            cap_x, cap_y, _, _ = meta['cap_full']
-           
-            meta['crop_area_rel'] = [x0, y0, x1-x0, y1-y0]
-            meta['crop_area_abs'] = [
+    def update_metadata(self, image_id, x0, y0, x1, y1):
+        """更新元数据（入队后由后台线程批量写入）"""
+        cap_x, cap_y = self.index.origins[image_id]
+        updates = {
+            'crop_area_rel': [x0, y0, x1-x0, y1-y0],
+            'crop_area_abs': [
                 cap_x + x0,
                 cap_y + y0,
                 x1-x0,
                 y1-y0
             ]
-            f.seek(0)
-            json.dump(meta, f, indent=4)
-            f.truncate()
+        }
+        if image_id in self.index.legacy_crops:
+            # 已有的 crop_image.jpg 是按旧坐标裁剪的，标记为过期，之后重新生成
+            updates['crop_image_rel'] = None
+            self.index.legacy_crops.discard(image_id)
+        self.meta_batcher.submit(image_id, updates)
             
     def previous_image(self):
         """返回上一张图像"""
@@ -238,11 +393,19 @@ class ImageCropperApp:
 
     def update_progress(self):
         """更新进度显示"""
-        text = f"正在处理：{self.current_index + 1}/{len(self.image_dirs)}"
+        text = f"正在处理：{self.current_index + 1}/{len(self.image_ids)}（已裁剪 {len(self.index.cropped)}）"
         self.progress_label.config(text=text)
 
     def run(self):
         self.root.mainloop()
+        if self.prefetcher is not None:
+            self.prefetcher.close()
+        if self.meta_batcher is not None:
+            self.meta_batcher.close()
+        if self.session is not None:
+            self.session.close()
+        if self.previews is not None:
+            self.previews.close()
 
 if __name__ == "__main__":
     app = ImageCropperApp()
@@ -0,0 +1,202 @@
+import sys
+import hashlib
+from collections import deque
+
+import cv2
+import numpy as np
+
+# 重复截图检测：最近 k 帧的特征堆叠成数组，新帧与所有历史帧在一次向量化计算中比较
+# 逐级过滤，只有难以判断的帧才计算 SSIM：
+# 1. 灰度图完全一致 -> 重复
+# 2. 感知哈希 (dHash) 差异大 -> 不重复
+# 3. 缩略图平均差异大 -> 不重复
+# 4. 其余帧在工作分辨率下批量计算 SSIM 并与 threshold 比较
+
+SMALL_WIDTH = 160  # 缩略图宽度
+SSIM_WIN = 7       # 与 skimage structural_similarity 默认参数一致
+SSIM_CHUNK = 8     # 每批计算 SSIM 的帧数，限制 float32 中间结果的内存
+
+
+def dhash(gray):
+    """ 计算 64 位差异哈希 """
+    small = cv2.resize(gray, (9, 8), interpolation=cv2.INTER_AREA)
+    bits = (small[:, 1:] > small[:, :-1]).flatten()
+    return int.from_bytes(np.packbits(bits).tobytes(), "big")
+
+
+def hamming(a, b):
+    return bin(a ^ b).count("1")
+
+
+def resize_to_width(gray, width):
+    """ 按宽度等比缩放，width 为 0 或不小于原宽度时返回原图 """
+    height, original_width = gray.shape
+    if not width or width >= original_width:
+        return gray
+    new_height = max(1, round(height * width / original_width))
+    return cv2.resize(gray, (width, new_height), interpolation=cv2.INTER_AREA)
+
+
+def box_mean(images, win=SSIM_WIN):
+    """ 对 (k, H, W) 的图像堆叠做均值滤波，并裁掉受边界影响的 win // 2 像素 """
+    k, height, width = images.shape
+    # k 帧竖向拼成一张图只调用一次 boxFilter，帧与帧交界处的结果会被裁掉，不影响有效区域
+    mean = cv2.boxFilter(images.reshape(k * height, width), -1, (win, win), borderType=cv2.BORDER_REFLECT)
+    pad = win // 2
+    return mean.reshape(k, height, width)[:, pad:height - pad, pad:width - pad]
+
+
+def batched_ssim(stack, current, data_range=255):
+    """ 计算 current 与 stack 中每一帧的平均 SSIM，结果与 skimage 默认参数一致 """
+    x = stack.astype(np.float32)
+    y = current.astype(np.float32)[None]
+    ux = box_mean(x)
+    uy = box_mean(y)
+    uxx = box_mean(x * x)
+    uyy = box_mean(y * y)
+    uxy = box_mean(x * y)
+
+    cov_norm = SSIM_WIN * SSIM_WIN / (SSIM_WIN * SSIM_WIN - 1)  # 样本协方差
+    vx = cov_norm * (uxx - ux * ux)
+    vy = cov_norm * (uyy - uy * uy)
+    vxy = cov_norm * (uxy - ux * uy)
+
+    c1 = (0.01 * data_range) ** 2
+    c2 = (0.03 * data_range) ** 2
+    s = ((2 * ux * uy + c1) * (2 * vxy + c2)) / ((ux * ux + uy * uy + c1) * (vx + vy + c2))
+    return s.mean(axis=(1, 2), dtype=np.float64)
+
+
+class FrameFingerprint:
+    """ 帧的去重特征，每帧只计算一次 """
+
+    def __init__(self, frame, working_width=0):
+        gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY) if frame.ndim == 3 else np.ascontiguousarray(frame)
+        self.shape = gray.shape
+        self.digest = hashlib.blake2b(gray, digest_size=16).digest()
+        self.hash = dhash(gray)
+        self.small = resize_to_width(gray, SMALL_WIDTH)
+        self.work = resize_to_width(gray, working_width)  # SSIM 使用的工作分辨率灰度图
+
+
+class DuplicateDetector:
+    """ 维护最近 k 帧的特征，判断新帧是否与其中任意一帧重复
+    历史只保存工作分辨率灰度图、缩略图和哈希，k 由 history_size 和 memory_budget 共同决定 """
+
+    def __init__(self, threshold, history_size=0, hash_distance=10, small_diff=2.0,
+                 working_width=0, early_exit=True, memory_budget=0):
+        if not history_size and not memory_budget:
+            raise ValueError("history_size 和 memory_budget 至少需要设置一个")
+        self.threshold = threshold
+        self.history_size = history_size    # 最多保存的帧数，0 表示只受内存预算限制
+        self.memory_budget = memory_budget  # 历史特征占用的字节上限，0 表示只受帧数限制
+        self.hash_distance = hash_distance  # dHash 汉明距离超过该值视为明显不同
+        self.small_diff = small_diff        # 缩略图平均灰度差超过该值视为明显不同
+        self.working_width = working_width  # SSIM 工作分辨率宽度，0 表示原分辨率
+        self.early_exit = early_exit        # 发现重复立即返回；否则比较完所有帧（都按 SSIM_CHUNK 分批，限制内存占用）
+        self.stats = {"exact": 0, "hash": 0, "small": 0, "ssim": 0}  # 各级做出判断的次数
+        self.reset()
+
+    def reset(self):
+        self.shape = None
+        self.capacity = 0
+        self.per_frame = 0
+        self.slots = deque()  # 按加入顺序保存的槽位编号
+        self.digests = {}
+        self.hashes = None
+        self.small = None
+        self.work = None
+
+    def __len__(self):
+        return len(self.slots)
+
+    def frame_bytes(self, fingerprint):
+        """ 单帧历史特征占用的字节数 """
+        return fingerprint.work.nbytes + fingerprint.small.nbytes + 8 + len(fingerprint.digest)
+
+    def memory_usage(self):
+        """ 当前历史特征占用的字节数 """
+        return len(self.slots) * self.per_frame
+
+    def fingerprint(self, frame):
+        return FrameFingerprint(frame, self.working_width)
+
+    def _candidates(self, fingerprint, slots):
+        """ 级联过滤，返回 (是否已确认重复, 需要计算 SSIM 的槽位) """
+        for slot in slots:
+            if self.digests[slot] == fingerprint.digest:
+                self.stats["exact"] += 1
+                return True, []
+
+        slots = np.asarray(slots)
+        xor = self.hashes[slots] ^ np.uint64(fingerprint.hash)
+        distance = np.unpackbits(xor.view(np.uint8)).reshape(len(slots), 64).sum(axis=1)
+        near = distance <= self.hash_distance
+        self.stats["hash"] += int((~near).sum())
+        slots = slots[near]
+        if not len(slots):
+            return False, []
+
+        diff = np.abs(self.small[slots].astype(np.int16) - fingerprint.small).mean(axis=(1, 2))
+        close = diff <= self.small_diff
+        self.stats["small"] += int((~close).sum())
+        return False, slots[close]
+
+    def is_duplicate(self, fingerprint):
+        """ 判断特征是否与最近的 k 张截图重复 """
+        if fingerprint.shape != self.shape or not self.slots:
+            return False
+
+        if min(fingerprint.work.shape) < SSIM_WIN:
+            return False  # 图像太小无法计算 SSIM
+
+        # 从最近的帧开始分批比较（最近的帧最可能重复），每批的 float32 中间结果大小固定
+        newest_first = list(reversed(self.slots))
+        duplicate = False
+        for i in range(0, len(newest_first), SSIM_CHUNK):
+            exact, slots = self._candidates(fingerprint, newest_first[i:i + SSIM_CHUNK])
+            if not exact and len(slots):
+                self.stats["ssim"] += len(slots)
+                exact = bool((batched_ssim(self.work[slots], fingerprint.work) > self.threshold).any())
+            duplicate = duplicate or exact
+            if duplicate and self.early_exit:
+                return True
+        return duplicate
+
+    def add(self, fingerprint):
+        """ 加入历史；窗口尺寸变化后旧的帧不可能再重复，直接清空 """
+        if fingerprint.shape != self.shape:
+            self.reset()
+            self.shape = fingerprint.shape
+            # 按内存预算换算可以保存的帧数
+            self.per_frame = self.frame_bytes(fingerprint)
+            capacity = self.history_size or sys.maxsize
+            if self.memory_budget:
+                capacity = min(capacity, max(1, self.memory_budget // self.per_frame))
+            self.capacity = capacity
+            self.hashes = np.zeros(capacity, dtype=np.uint64)
+            self.small = np.zeros((capacity,) + fingerprint.small.shape, dtype=np.uint8)
+            self.work = np.zeros((capacity,) + fingerprint.work.shape, dtype=np.uint8)
+
+        if len(self.slots) < self.capacity:
+            slot = len(self.slots)
+        else:
+            slot = self.slots.popleft()  # 复用最旧一帧的槽位
+        self.slots.append(slot)
+        self.digests[slot] = fingerprint.digest
+        self.hashes[slot] = fingerprint.hash
+        self.small[slot] = fingerprint.small
+        self.work[slot] = fingerprint.work
+
+
+def create_detector(config):
+    """ 按录制配置创建去重器 """
+    return DuplicateDetector(
+        config["threshold"],
+        config["recent_screenshots_count"],
+        hash_distance=config["dedup_hash_distance"],
+        small_diff=config["dedup_small_diff"],
+        working_width=config["dedup_working_width"],
+        early_exit=config["dedup_early_exit"],
+        memory_budget=int(config["dedup_memory_budget_mb"] * 1024 * 1024)
+    )
@@ -0,0 +1,129 @@
+import sys
+
+import cv2
+import numpy as np
+
+from session import open_session
+
+# 脏区域检测与增量存储
+# 每张截图记录相对上一张保存的截图发生变化的矩形 dirty_regions [x, y, width, height]
+# 开启增量存储后，关键帧保存完整的 cap_full_image，其余截图只保存变化区域 delta_{i}，
+# 需要完整图片时用 restore_session 从关键帧依次叠加恢复
+
+
+def decode(data):
+    return cv2.imdecode(np.frombuffer(data, dtype=np.uint8), cv2.IMREAD_COLOR)
+
+
+def dirty_regions(previous, current, tile=32, min_diff=8):
+    """ 比较两张同尺寸灰度图，返回按 tile 对齐的变化区域列表 """
+    if previous is None or previous.shape != current.shape:
+        return [[0, 0, current.shape[1], current.shape[0]]]
+
+    height, width = current.shape
+    changed = cv2.absdiff(previous, current) > min_diff
+    rows = -(-height // tile)
+    cols = -(-width // tile)
+    padded = np.zeros((rows * tile, cols * tile), dtype=bool)
+    padded[:height, :width] = changed
+    tiles = padded.reshape(rows, tile, cols, tile).any(axis=(1, 3)).astype(np.uint8)
+    if not tiles.any():
+        return []
+
+    # 相邻的变化 tile 合并成一个矩形
+    count, _, stats, _ = cv2.connectedComponentsWithStats(tiles, connectivity=8)
+    regions = []
+    for x, y, w, h, _ in stats[1:count]:
+        left, top = int(x) * tile, int(y) * tile
+        regions.append([left, top, min((int(x) + int(w)) * tile, width) - left, min((int(y) + int(h)) * tile, height) - top])
+    return regions
+
+
+class DeltaTracker:
+    """ 记录上一张保存的截图，为新截图计算脏区域并决定是否作为关键帧
+    track 只计算，截图确实进入写入队列后再调用 commit，被丢弃的截图不会成为后续增量的基准
+    基准是 restore_session 能恢复出的图像（关键帧 + 已保存的变化区域），而不是上一张原始截图，
+    否则每张只变化一点（低于 min_diff）的渐变会一直检测不到，恢复结果与实际截图越差越远 """
+
+    def __init__(self, keyframe_interval=30, max_delta_ratio=0.5, tile=32, min_diff=8, ext=".jpg"):
+        self.keyframe_interval = keyframe_interval  # 每隔多少张截图保存一次完整关键帧
+        self.max_delta_ratio = max_delta_ratio      # 变化面积超过该比例时直接保存关键帧
+        self.tile = tile
+        self.min_diff = min_diff
+        self.ext = ext  # 增量区域图片的扩展名，与全屏截图的编码格式一致
+        self.previous = None
+        self.previous_id = None
+        self.since_keyframe = 0
+        self._pending = None  # 最近一次 track 的 (image_id, gray, 是否关键帧, 脏区域)
+
+    def track(self, image_id, gray):
+        """ 返回写入 image_meta.json 的增量字段，不改变记录的上一张截图 """
+        regions = dirty_regions(self.previous, gray, self.tile, self.min_diff)
+        changed = sum(w * h for _, _, w, h in regions)
+        keyframe = (
+            self.previous is None
+            or self.previous.shape != gray.shape
+            or self.since_keyframe + 1 >= self.keyframe_interval
+            or changed > self.max_delta_ratio * gray.size
+        )
+        meta = {"dirty_regions": regions, "keyframe": keyframe}
+        if not keyframe:
+            meta["base_id"] = self.previous_id
+            meta["delta_files"] = [f"delta_{i}{self.ext}" for i in range(len(regions))]
+        self._pending = (image_id, gray, keyframe, regions)
+        return meta
+
+    def commit(self):
+        """ 最近一次 track 的截图已经提交写入，作为下一张截图的基准 """
+        image_id, gray, keyframe, regions = self._pending
+        self._pending = None
+        self.since_keyframe = 0 if keyframe else self.since_keyframe + 1
+        if keyframe:
+            self.previous = gray
+        else:
+            # 只把保存了的变化区域叠加到基准上，未超过 min_diff 的变化继续累积
+            self.previous = self.previous.copy()
+            for x, y, w, h in regions:
+                self.previous[y:y + h, x:x + w] = gray[y:y + h, x:x + w]
+        self.previous_id = image_id
+
+
+def restore_session(app_dir, jpeg_quality=95):
+    """ 从关键帧依次叠加增量区域，补全增量截图的 cap_full_image.jpg 和 cap_area_image.jpg """
+    session = open_session(app_dir)
+    params = [int(cv2.IMWRITE_JPEG_QUALITY), jpeg_quality]
+    canvas = None
+    canvas_id = None
+    restored = 0
+    for image_id in session.image_ids():
+        meta = session.read_meta(image_id)
+        if "delta_files" not in meta:
+            full_name = session.find(image_id, 'cap_full_image')
+            canvas = decode(session.read_bytes(image_id, full_name)) if full_name else None
+            canvas_id = image_id
+            continue
+        if canvas is None or canvas_id != meta["base_id"]:
+            print(f"跳过 {image_id}: 缺少基准截图 {meta['base_id']}")
+            canvas = None
+            continue
+
+        canvas = canvas.copy()
+        for (x, y, w, h), name in zip(meta["dirty_regions"], meta["delta_files"]):
+            canvas[y:y + h, x:x + w] = decode(session.read_bytes(image_id, name))
+        canvas_id = image_id
+        if not session.find(image_id, 'cap_full_image'):
+            x, y, w, h = meta["cap_area"]
+            full_x, full_y, _, _ = meta["cap_full"]
+            area = canvas[y - full_y:y - full_y + h, x - full_x:x - full_x + w]
+            session.write(image_id, {
+                'cap_full_image.jpg': cv2.imencode(".jpg", canvas, params)[1].tobytes(),
+                'cap_area_image.jpg': cv2.imencode(".jpg", area, params)[1].tobytes()
+            })
+            restored += 1
+    session.close()
+    return restored
+
+
+if __name__ == "__main__":
+    app_folder = sys.argv[1] if len(sys.argv) > 1 else input("请输入APP目录路径: ").strip()
+    print(f"已恢复 {restore_session(app_folder)} 张增量截图")
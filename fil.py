@@ -5,6 +5,8 @@ import tkinter as tk
 from tkinter import ttk, filedialog, messagebox
 from PIL import Image, ImageTk, ImageDraw
 
+from preview import PreviewLookup
+
 class CSVImageReviewer:
     def __init__(self, root):
         self.root = root
@@ -15,6 +17,7 @@ class CSVImageReviewer:
         self.data = []          
         self.current_index = 0  
         self.img_cache = {}     
+        self.previews = PreviewLookup()  # 有预览金字塔时只加载需要的那一级
         self.csv_path = ""      
         self.image_base = ""    
         self.zoom_level = 1.0
@@ -219,16 +222,17 @@ class CSVImageReviewer:
         try:
             # 加载图片
             if img_path not in self.img_cache:
-                img = Image.open(img_path)
+                with Image.open(img_path) as img:  # 只读文件头获取尺寸
+                    size = img.size
                 self.img_cache[img_path] = {
-                    'original': img,
+                    'size': size,
                     'bbox': self.parse_bbox(row['bbox'])
                 }
                 # 计算初始缩放比例
                 canvas_width = self.main_canvas.winfo_width() - 20
                 canvas_height = self.main_canvas.winfo_height() - 20
-                width_ratio = canvas_width / img.width
-                height_ratio = canvas_height / img.height
+                width_ratio = canvas_width / size[0]
+                height_ratio = canvas_height / size[1]
                 self.zoom_level = min(width_ratio, height_ratio)
 
             bbox = self.parse_bbox(row['bbox'])
@@ -253,18 +257,28 @@ class CSVImageReviewer:
         except:
             return (0, 0, 100, 100)
 
+    def open_scaled(self, img_path, scale):
+        """返回 (图片, 缩放系数)：有预览时加载合适的一级，否则使用缓存的原图（每张原图只解码一次）"""
+        found = self.previews.open_scale(img_path, scale)
+        if found is not None:
+            return found
+        img_data = self.img_cache[img_path]
+        if 'original' not in img_data:
+            img = Image.open(img_path)
+            img.load()
+            img_data['original'] = img
+        return img_data['original'], 1.0
+
     def display_main_image(self, img_path, bbox):
         """显示主图"""
-        img_data = self.img_cache[img_path]
-        img = img_data['original']
+        width, height = self.img_cache[img_path]['size']
+        img, _ = self.open_scaled(img_path, self.zoom_level)
 
-        
-        
         # 缩放处理
 
-        scaled_w = int(img.width * self.zoom_level)
-        scaled_h = int(img.height * self.zoom_level)
-        scaled_img = img.resize((scaled_w, scaled_h), Image.Resampling.LANCZOS)
+        scaled_w = int(width * self.zoom_level)
+        scaled_h = int(height * self.zoom_level)
+        scaled_img = img.convert('RGB').resize((scaled_w, scaled_h), Image.Resampling.LANCZOS)
         
         # 绘制边界框
         draw = ImageDraw.Draw(scaled_img)
@@ -284,17 +298,17 @@ class CSVImageReviewer:
 
     def display_zoom_view(self, img_path, bbox):
         """显示局部放大"""
-        img_data = self.img_cache[img_path]
-        img = img_data['original']
-        
-        # 裁剪区域
-        crop_img = img.crop(bbox)
-        
         # 计算最佳缩放
+        crop_w = bbox[2] - bbox[0]
+        crop_h = bbox[3] - bbox[1]
         canvas_w = self.zoom_canvas.winfo_width() - 20
         canvas_h = self.zoom_canvas.winfo_height() - 20
-        ratio = min(canvas_w/crop_img.width, canvas_h/crop_img.height)
-        new_size = (int(crop_img.width*ratio), int(crop_img.height*ratio))
+        ratio = min(canvas_w/crop_w, canvas_h/crop_h)
+        new_size = (int(crop_w*ratio), int(crop_h*ratio))
+
+        # 裁剪区域（在不小于放大倍数的一级预览上裁剪）
+        img, factor = self.open_scaled(img_path, ratio)
+        crop_img = img.crop(tuple(round(v * factor) for v in bbox))
         
         # 高质量缩放
         zoom_img = crop_img.resize(new_size, Image.Resampling.LANCZOS)
@@ -5,6 +5,8 @@ import tkinter as tk
 from tkinter import ttk, filedialog, messagebox
 from PIL import Image, ImageTk, ImageDraw
 
+from preview import PreviewLookup
+
 class CSVImageReviewer:
     def __init__(self, root):
         self.root = root
@@ -15,6 +17,7 @@ class CSVImageReviewer:
         self.data = []          
         self.current_index = 0  
         self.img_cache = {}     
+        self.previews = PreviewLookup()  # 有预览金字塔时只加载需要的那一级
         self.csv_path = ""      
         self.image_base = ""    # 新增：图片根目录
         
@@ -203,25 +206,31 @@ class CSVImageReviewer:
         try:
             # 缓存检查与加载
             if img_path not in self.img_cache:
-                img = Image.open(img_path)
+                with Image.open(img_path) as img:  # 只读文件头获取尺寸
+                    size = img.size
                 self.img_cache[img_path] = {
-                    'original': img,
+                    'size': size,
                     'display': None,
                     'bbox': self.parse_bbox(row['bbox'])
                 }
             
             img_data = self.img_cache[img_path]
-            orig_img = img_data['original']
+            orig_size = img_data['size']
             
             # 生成显示图片（带缩放）
-            display_img = orig_img.copy()
-            display_img.thumbnail((600, 600), Image.Resampling.LANCZOS)
+            if img_data['display'] is None:
+                scale = min(600 / orig_size[0], 600 / orig_size[1], 1)
+                display_img, _ = self.open_scaled(img_path, scale)
+                display_img = display_img.convert('RGB')
+                display_img.thumbnail((round(orig_size[0] * scale), round(orig_size[1] * scale)), Image.Resampling.LANCZOS)
+                img_data['display'] = display_img
+            display_img = img_data['display'].copy()
             
             # 绘制边界框
             draw = ImageDraw.Draw(display_img)
             scaled_bbox = self.scale_bbox(
                 img_data['bbox'], 
-                orig_img.size, 
+                orig_size, 
                 display_img.size
             )
             draw.rectangle(scaled_bbox, outline='red', width=3)
@@ -232,7 +241,7 @@ class CSVImageReviewer:
             self.main_canvas.create_image(0, 0, anchor=tk.NW, image=self.main_photo)
             
             # 更新放大视图
-            self.show_zoom_view(orig_img, img_data['bbox'])
+            self.show_zoom_view(img_path, img_data['bbox'])
             
             # 更新文字信息
             self.instruction_label.config(text=f"Instruction: {row['instruction']}")
@@ -267,10 +276,24 @@ class CSVImageReviewer:
             int(bbox[3] * y_scale)
         )
 
-    def show_zoom_view(self, img, bbox):
+    def open_scaled(self, img_path, scale):
+        """返回 (图片, 缩放系数)：有预览时加载合适的一级，否则使用缓存的原图（每张原图只解码一次）"""
+        found = self.previews.open_scale(img_path, scale)
+        if found is not None:
+            return found
+        img_data = self.img_cache[img_path]
+        if 'original' not in img_data:
+            img = Image.open(img_path)
+            img.load()
+            img_data['original'] = img
+        return img_data['original'], 1.0
+
+    def show_zoom_view(self, img_path, bbox):
         """显示局部放大图"""
         try:
-            zoom_img = img.crop(bbox)
+            scale = min(400 / (bbox[2] - bbox[0]), 400 / (bbox[3] - bbox[1]), 1)
+            img, factor = self.open_scaled(img_path, scale)
+            zoom_img = img.crop(tuple(round(v * factor) for v in bbox))
             zoom_img.thumbnail((400, 400), Image.Resampling.LANCZOS)
             self.zoom_photo = ImageTk.PhotoImage(zoom_img)
             self.zoom_canvas.delete("all")
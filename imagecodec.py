@@ -0,0 +1,154 @@
+import sys
+import json
+import time
+import random
+import argparse
+
+import cv2
+import numpy as np
+
+from session import open_session
+
+# 图片编码设置
+# 每类图片（应用截图 area_codec、全屏截图 full_codec）可以单独配置:
+#   format:      jpeg / webp / png
+#   quality:     jpeg / webp 的质量（0-100）
+#   optimize:    jpeg 优化哈夫曼表（更小，稍慢）
+#   progressive: jpeg 渐进式编码
+#   lossless:    webp 无损；png 本身就是无损
+#   compression: png 压缩级别（0-9，1 最快）
+# python imagecodec.py bench [app目录] 用录制结果测量各设置的编码耗时和文件大小
+
+EXTENSIONS = {"jpeg": ".jpg", "webp": ".webp", "png": ".png"}
+DEFAULT_SETTINGS = {
+    "format": "jpeg",
+    "quality": 80,
+    "optimize": False,
+    "progressive": False,
+    "lossless": False,
+    "compression": 1
+}
+
+# 基准模式默认比较的设置
+BENCH_PRESETS = [
+    {"format": "jpeg", "quality": 80},
+    {"format": "jpeg", "quality": 80, "optimize": True},
+    {"format": "jpeg", "quality": 80, "progressive": True},
+    {"format": "jpeg", "quality": 95},
+    {"format": "webp", "quality": 80},
+    {"format": "webp", "lossless": True},
+    {"format": "png", "compression": 1},
+    {"format": "png", "compression": 6}
+]
+
+
+def codec_settings(config, key):
+    """ 读取某类图片的编码设置，未配置的字段使用默认值，质量默认取 jpeg_quality """
+    settings = dict(DEFAULT_SETTINGS, quality=config["jpeg_quality"])
+    settings.update(config.get(key) or {})
+    if settings["format"] not in EXTENSIONS:
+        raise ValueError(f"未知的图片格式: {settings['format']}")
+    return settings
+
+
+def extension(settings):
+    return EXTENSIONS[settings["format"]]
+
+
+def encode_params(settings):
+    """ 转换为 cv2.imencode 参数 """
+    if settings["format"] == "jpeg":
+        return [
+            int(cv2.IMWRITE_JPEG_QUALITY), int(settings["quality"]),
+            int(cv2.IMWRITE_JPEG_OPTIMIZE), int(bool(settings["optimize"])),
+            int(cv2.IMWRITE_JPEG_PROGRESSIVE), int(bool(settings["progressive"]))
+        ]
+    if settings["format"] == "webp":
+        return [int(cv2.IMWRITE_WEBP_QUALITY), 101 if settings["lossless"] else int(settings["quality"])]  # 101 为无损
+    return [int(cv2.IMWRITE_PNG_COMPRESSION), int(settings["compression"])]
+
+
+def encode(frame, settings):
+    """ 编码为字节 """
+    ok, data = cv2.imencode(extension(settings), frame, encode_params(settings))
+    if not ok:
+        raise ValueError(f"图片编码失败: {settings}")
+    return data.tobytes()
+
+
+def describe(settings):
+    settings = dict(DEFAULT_SETTINGS, **settings)
+    if settings["format"] == "png":
+        return f"png c{settings['compression']}"
+    if settings["format"] == "webp":
+        return "webp lossless" if settings["lossless"] else f"webp q{settings['quality']}"
+    flags = "".join([" opt" if settings["optimize"] else "", " prog" if settings["progressive"] else ""])
+    return f"jpeg q{settings['quality']}{flags}"
+
+
+def psnr(a, b):
+    mse = np.mean((a.astype(np.float64) - b.astype(np.float64)) ** 2)
+    return float("inf") if mse == 0 else 10 * np.log10(255 ** 2 / mse)
+
+
+def benchmark(frames, presets):
+    """ 对每种设置编码所有样本帧，返回 ms/帧、字节/帧和平均 PSNR """
+    results = []
+    for settings in presets:
+        full = dict(DEFAULT_SETTINGS, **settings)
+        elapsed = 0.0
+        total_bytes = 0
+        quality = []
+        for frame in frames:
+            start = time.perf_counter()
+            data = encode(frame, full)
+            elapsed += time.perf_counter() - start
+            total_bytes += len(data)
+            decoded = cv2.imdecode(np.frombuffer(data, dtype=np.uint8), cv2.IMREAD_COLOR)
+            quality.append(psnr(frame, decoded))
+        results.append({
+            "settings": settings,
+            "name": describe(settings),
+            "ms_per_frame": elapsed * 1000 / len(frames),
+            "bytes_per_frame": total_bytes / len(frames),
+            "psnr": float(np.mean(quality))
+        })
+    return results
+
+
+def load_sample(app_dir, name, sample):
+    """ 从录制目录随机抽取 sample 张图片 """
+    session = open_session(app_dir)
+    image_ids = [image_id for image_id in session.image_ids() if session.find(image_id, name)]
+    random.seed(0)
+    frames = []
+    for image_id in random.sample(image_ids, min(sample, len(image_ids))):
+        data = session.read_bytes(image_id, session.find(image_id, name))
+        frames.append(cv2.imdecode(np.frombuffer(data, dtype=np.uint8), cv2.IMREAD_COLOR))
+    session.close()
+    return frames
+
+
+def main():
+    parser = argparse.ArgumentParser(description="图片编码设置基准")
+    parser.add_argument("command", choices=["bench"])
+    parser.add_argument("app_dir", help="录制目录，即 ./[base_save_path]/[app_name]")
+    parser.add_argument("--image", default="cap_full_image", help="抽样的图片: cap_full_image 或 cap_area_image")
+    parser.add_argument("--sample", type=int, default=20, help="抽样张数")
+    parser.add_argument("--settings", action="append", help='额外比较的设置（JSON），如 {"format": "webp", "quality": 90}')
+    args = parser.parse_args()
+
+    frames = load_sample(args.app_dir, args.image, args.sample)
+    if not frames:
+        print("录制目录中没有可用的图片")
+        sys.exit(1)
+    presets = BENCH_PRESETS + [json.loads(text) for text in args.settings or []]
+
+    print(f"样本: {len(frames)} 张 {args.image}（PSNR 以录制保存的图片为参照）")
+    print(f"{'设置':<22}{'ms/张':>10}{'KB/张':>12}{'PSNR(dB)':>10}")
+    for result in benchmark(frames, presets):
+        print(f"{result['name']:<24}{result['ms_per_frame']:>10.2f}{result['bytes_per_frame'] / 1024:>12.1f}{result['psnr']:>10.2f}")
+
+
+if __name__ == "__main__":
+    main()
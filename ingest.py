@@ -0,0 +1,178 @@
+import os
+import sys
+import time
+import argparse
+from collections import deque
+from datetime import datetime
+from concurrent.futures import ProcessPoolExecutor
+
+import cv2
+
+import imagecodec
+from dedup import create_detector
+from session import ImageIdGenerator, open_session
+from config import clean_folder_name, load_config
+
+# 离线导入：把已有的录屏视频或截图文件夹转换为录制目录（image_id/cap_full_image + image_meta.json）
+# 视频按帧范围切分成若干段，进程池中每段独立解码、去重并编码，主进程按顺序取回结果，
+# 再用一个去重器对跨段的候选帧做最终去重后写入，结果与按顺序逐帧处理基本一致
+# 视频的 image_id 按 起始时间 + 帧时间戳 生成，文件夹中的图片使用文件修改时间
+# 内存：每个进程同时只有一段在处理，等待合并的段数不超过进程数；段结果中 SSIM 用的工作分辨率灰度图
+# 用 PNG 无损压缩后传回（界面截图压缩率很高），主进程合并时逐帧解压
+
+IMAGE_SUFFIXES = (".jpg", ".jpeg", ".png", ".bmp", ".webp")
+
+_config = None
+
+
+def plan_segments(source, segment_size=600, step=1, start_time=None):
+    """ 把来源切分成若干段，每段是可以独立处理的 dict """
+    if os.path.isdir(source):
+        files = sorted(name for name in os.listdir(source) if name.lower().endswith(IMAGE_SUFFIXES))
+        items = [(index, os.path.join(source, name)) for index, name in enumerate(files)][::step]
+        return [
+            {"kind": "images", "files": [(index, path, os.path.getmtime(path)) for index, path in items[i:i + segment_size]]}
+            for i in range(0, len(items), segment_size)
+        ]
+
+    capture = cv2.VideoCapture(source)
+    if not capture.isOpened():
+        raise ValueError(f"无法打开视频: {source}")
+    total = int(capture.get(cv2.CAP_PROP_FRAME_COUNT))
+    fps = capture.get(cv2.CAP_PROP_FPS) or 30.0
+    capture.release()
+    if start_time is None:
+        start_time = os.path.getmtime(source) - total / fps  # 修改时间近似为录制结束时间
+    size = max(step, segment_size - segment_size % step)  # 段边界对齐 step，抽帧位置与不分段时一致
+    return [
+        {"kind": "video", "path": source, "start": start, "end": min(start + size, total),
+         "step": step, "fps": fps, "start_time": start_time}
+        for start in range(0, total, size)
+    ]
+
+
+def read_segment(segment):
+    """ 依次产生 (帧序号, 时间戳, BGR 帧) """
+    if segment["kind"] == "images":
+        for index, path, mtime in segment["files"]:
+            frame = cv2.imread(path, cv2.IMREAD_COLOR)
+            if frame is None:
+                print(f"跳过无法读取的图片: {path}")
+                continue
+            yield index, mtime, frame
+        return
+
+    capture = cv2.VideoCapture(segment["path"])
+    capture.set(cv2.CAP_PROP_POS_FRAMES, segment["start"])
+    try:
+        for index in range(segment["start"], segment["end"]):
+            if (index - segment["start"]) % segment["step"]:
+                if not capture.grab():  # 跳过的帧只解复用，不做颜色转换
+                    return
+                continue
+            ok, frame = capture.read()
+            if not ok:
+                return
+            yield index, segment["start_time"] + index / segment["fps"], frame
+    finally:
+        capture.release()
+
+
+def _init_worker(config):
+    global _config
+    _config = config
+    cv2.setNumThreads(1)  # 并行度由进程池提供
+
+
+def pack_work(fingerprint):
+    """ 把特征中的工作分辨率灰度图换成 PNG 字节，减小段结果占用的内存 """
+    fingerprint.work = cv2.imencode(".png", fingerprint.work, [int(cv2.IMWRITE_PNG_COMPRESSION), 1])[1]
+    return fingerprint
+
+
+def unpack_work(fingerprint):
+    fingerprint.work = cv2.imdecode(fingerprint.work, cv2.IMREAD_GRAYSCALE)
+    return fingerprint
+
+
+def process_segment(segment):
+    """ 进程池中执行：段内去重并编码候选帧，返回 [(帧序号, 时间戳, 尺寸, 特征, 图片字节)]，特征中的灰度图已压缩 """
+    detector = create_detector(_config)
+    settings = imagecodec.codec_settings(_config, "full_codec")
+    candidates = []
+    for index, timestamp, frame in read_segment(segment):
+        fingerprint = detector.fingerprint(frame)
+        if detector.is_duplicate(fingerprint):
+            continue
+        detector.add(fingerprint)
+        candidates.append((index, timestamp, frame.shape[:2], pack_work(fingerprint), imagecodec.encode(frame, settings)))
+    return candidates
+
+
+def ingest(source, app_dir, config, workers=None, segment_size=600, step=1, start_time=None):
+    """ 导入视频或图片文件夹，返回 (处理的段数, 保存的截图数) """
+    segments = plan_segments(source, segment_size, step, start_time)
+    session = open_session(app_dir, config["storage_format"])
+    detector = create_detector(config)
+    image_ids = ImageIdGenerator()
+    settings = imagecodec.codec_settings(config, "full_codec")
+    name = "cap_full_image" + imagecodec.extension(settings)
+    workers = workers or os.cpu_count() or 1
+    saved = 0
+    started = time.perf_counter()
+
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(config,)) as pool:
+        pending = deque()
+        remaining = iter(segments)
+        for segment in remaining:
+            pending.append(pool.submit(process_segment, segment))
+            if len(pending) >= workers:
+                break
+        done = 0
+        while pending:
+            candidates = pending.popleft().result()  # 按段的顺序取回，保证输出有序
+            next_segment = next(remaining, None)
+            if next_segment is not None:
+                pending.append(pool.submit(process_segment, next_segment))
+
+            for index, timestamp, (height, width), fingerprint, data in candidates:
+                fingerprint = unpack_work(fingerprint)
+                if detector.is_duplicate(fingerprint):  # 与前面各段保存的截图重复
+                    continue
+                detector.add(fingerprint)
+                image_id = image_ids.next(datetime.fromtimestamp(timestamp))
+                session.write(image_id, {name: data})
+                session.write_meta(image_id, {
+                    "image_id": image_id,
+                    "cap_area": [0, 0, width, height],
+                    "cap_full": [0, 0, width, height],
+                    "source": {"path": os.path.abspath(source), "frame": index}
+                })
+                saved += 1
+            done += 1
+            print(f"已处理 {done}/{len(segments)} 段, 保存 {saved} 张截图, {time.perf_counter() - started:.1f} 秒")
+
+    session.close()
+    return len(segments), saved
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="从录屏视频或截图文件夹导入录制目录")
+    parser.add_argument("source", help="视频文件（cv2.VideoCapture 支持的格式）或图片文件夹")
+    parser.add_argument("app_name", nargs="?", help="保存目录名，默认使用来源文件名，结果保存到 ./[base_save_path]/[app_name]")
+    parser.add_argument("--workers", type=int, help="进程数，默认使用全部 CPU")
+    parser.add_argument("--segment", type=int, default=600, help="每段的帧数")
+    parser.add_argument("--step", type=int, default=1, help="每隔多少帧取一帧，如 60 fps 视频用 --step 10 按 6 fps 取帧")
+    parser.add_argument("--start", help='视频开始录制的时间，如 "2024-05-01 10:00:00"，默认按文件修改时间和时长推算')
+    args = parser.parse_args()
+
+    config = load_config()
+    app_name = clean_folder_name(args.app_name or os.path.splitext(os.path.basename(os.path.normpath(args.source)))[0])
+    start_time = datetime.strptime(args.start, "%Y-%m-%d %H:%M:%S").timestamp() if args.start else None
+    app_dir = os.path.join(config["base_save_path"], app_name)
+    try:
+        segments, saved = ingest(args.source, app_dir, config, args.workers, args.segment, args.step, start_time)
+    except ValueError as e:
+        print(e)
+        sys.exit(1)
+    print(f"导入完成: {saved} 张截图保存到 {app_dir}")
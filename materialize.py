@@ -0,0 +1,155 @@
+import io
+import os
+import sys
+import shutil
+import argparse
+import subprocess
+from concurrent.futures import ProcessPoolExecutor
+
+import cv2
+import numpy as np
+
+from session import init_worker, open_session, worker_session
+
+# 生成裁剪图片：crop.py 只在元数据中记录裁剪坐标 crop_area_rel，crop_image.jpg 之后批量生成
+# - cap_full_image 是 JPEG、裁剪区域左上角对齐 MCU（通常 8 或 16 像素）且安装了 jpegtran 时，
+#   用 jpegtran -crop 直接截取压缩数据，无损且不需要解码
+# - 其余情况解码后裁剪，按 JPEG 质量 95 重新编码（与原来 crop.py 相同）；超出图片的部分与 PIL crop 一样填充黑色，
+#   裁剪图片尺寸始终等于 crop_area_rel 中的宽高
+# 生成后在元数据中写入 crop_image_rel（生成时使用的坐标），重新裁剪后坐标不一致时会再次生成；
+# 旧版 crop.py 直接保存的裁剪图片没有 crop_image_rel，视为与当前坐标一致
+# merge.py 合并前自动生成缺少的裁剪图片，也可以运行 python materialize.py [app目录] 提前生成
+
+CROP_IMAGE = "crop_image.jpg"
+QUALITY = 95
+JPEGTRAN = shutil.which("jpegtran")
+
+
+def needs_crop(session, image_id, meta):
+    """ 已经裁剪但还没有生成裁剪图片，或裁剪图片不是按当前坐标生成的 """
+    if "crop_area_rel" not in meta:
+        return False
+    if not session.has(image_id, CROP_IMAGE):
+        return True
+    return "crop_image_rel" in meta and meta["crop_image_rel"] != meta["crop_area_rel"]
+
+
+def pad_crop(frame, x, y, w, h):
+    """ 与 PIL crop 相同：超出图片的部分用黑色填充，结果尺寸始终等于记录的 宽 x 高 """
+    height, width = frame.shape[:2]
+    out = np.zeros((h, w) + frame.shape[2:], dtype=frame.dtype)
+    left, top = max(0, x), max(0, y)
+    right, bottom = min(width, x + w), min(height, y + h)
+    if right > left and bottom > top:
+        out[top - y:bottom - y, left - x:right - x] = frame[top:bottom, left:right]
+    return out
+
+
+def mcu_size(image):
+    """ JPEG 最小编码单元的像素尺寸，由最大的采样因子决定 """
+    return 8 * max(layer[1] for layer in image.layer), 8 * max(layer[2] for layer in image.layer)
+
+
+def lossless_crop(data, x, y, w, h):
+    """ 用 jpegtran 无损裁剪，失败或结果尺寸不符时返回 None """
+    from PIL import Image
+    try:
+        result = subprocess.run(
+            [JPEGTRAN, "-copy", "none", "-crop", f"{w}x{h}+{x}+{y}"],
+            input=data, capture_output=True, check=True
+        ).stdout
+        if Image.open(io.BytesIO(result)).size == (w, h):
+            return result
+    except (subprocess.CalledProcessError, OSError) as e:
+        print(f"jpegtran 裁剪失败，改为重新编码: {e}")
+    return None
+
+
+def crop_bytes(data, rect):
+    """ 返回 (裁剪后的 JPEG 字节, 是否无损)，裁剪区域为空时返回 (None, False) """
+    from PIL import Image
+    image = Image.open(io.BytesIO(data))  # 只读文件头
+    x, y, w, h = rect
+    if w <= 0 or h <= 0:
+        return None, False
+    inside = x >= 0 and y >= 0 and x + w <= image.size[0] and y + h <= image.size[1]
+    if JPEGTRAN and image.format == "JPEG" and inside:
+        mcu_w, mcu_h = mcu_size(image)
+        if x % mcu_w == 0 and y % mcu_h == 0:
+            result = lossless_crop(data, x, y, w, h)
+            if result is not None:
+                return result, True
+    frame = cv2.imdecode(np.frombuffer(data, dtype=np.uint8), cv2.IMREAD_COLOR)
+    crop = frame[y:y + h, x:x + w] if inside else pad_crop(frame, x, y, w, h)
+    return cv2.imencode(".jpg", crop, [int(cv2.IMWRITE_JPEG_QUALITY), QUALITY])[1].tobytes(), False
+
+
+def crop_capture(job):
+    """ 进程池中执行：返回 (image_id, 坐标, 裁剪图片字节, 是否无损) """
+    image_id, rect = job
+    session = worker_session()
+    name = session.find(image_id, "cap_full_image")
+    if name is None:
+        return image_id, rect, None, False  # 增量截图需要先运行 delta.py 恢复
+    data, lossless = crop_bytes(bytes(session.read_bytes(image_id, name)), rect)
+    return image_id, rect, data, lossless
+
+
+def materialize(app_dir, image_ids=None, workers=None, batch=256):
+    """ 生成缺少或过期的裁剪图片，image_ids 为 None 时处理整个目录，返回生成的数量
+    workers 为 1 时在当前进程中执行（merge.py 批量模式已经在进程池中） """
+    session = open_session(app_dir)
+    metas = session.metas()
+    if image_ids is not None:
+        metas = {image_id: metas[image_id] for image_id in image_ids if image_id in metas}
+    jobs = [(image_id, meta["crop_area_rel"]) for image_id, meta in metas.items() if needs_crop(session, image_id, meta)]
+    if not jobs:
+        session.close()
+        return 0
+
+    workers = workers or os.cpu_count() or 1
+    pool = None
+    if workers > 1:
+        pool = ProcessPoolExecutor(max_workers=workers, initializer=init_worker, initargs=(app_dir,))
+        results = pool.map(crop_capture, jobs, chunksize=8)
+    else:
+        init_worker(app_dir)
+        results = map(crop_capture, jobs)
+
+    created = 0
+    lossless_count = 0
+    updates = {}
+    for image_id, rect, data, lossless in results:
+        if data is None:
+            print(f"跳过 {image_id}: 缺少 cap_full_image 或裁剪区域为空")
+            continue
+        session.write(image_id, {CROP_IMAGE: data})
+        updates[image_id] = {"crop_image_rel": rect}
+        created += 1
+        lossless_count += lossless
+        if len(updates) >= batch:
+            session.update_metas(updates)
+            updates = {}
+    if updates:
+        session.update_metas(updates)
+    if pool is not None:
+        pool.shutdown()
+    else:
+        worker_session().close()
+    session.close()
+    print(f"已生成 {created} 张裁剪图片（无损 {lossless_count} 张）")
+    return created
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="按 crop.py 记录的坐标批量生成 crop_image.jpg")
+    parser.add_argument("app_dir", help="录制目录，即 ./[base_save_path]/[app_name]")
+    parser.add_argument("--workers", type=int, help="进程数，默认使用全部 CPU")
+    args = parser.parse_args()
+
+    if not os.path.isdir(args.app_dir):
+        print(f"目录不存在: {args.app_dir}")
+        sys.exit(1)
+    if JPEGTRAN is None:
+        print("未找到 jpegtran，所有裁剪图片都将重新编码")
+    materialize(args.app_dir, workers=args.workers)
@@ -1,39 +1,42 @@
 import os
+import sys
 import json
 import csv
-import zipfile
-from typing import List
+import time
+import argparse
+import numpy as np
+from typing import Dict, List
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from materialize import materialize
+from packager import describe, file_entry, write_zip
+from session import IMAGE_EXTENSIONS, open_session
+
+BBOX_FIELDS = ('cap_area', 'cap_full', 'crop_area_rel', 'crop_area_abs')
+STATE_FILE = '.merge_state.json'  # 上次合并的 app 名称和每行的内容指纹
 
 def validate_metadata(data: dict) -> bool:
     """验证元数据是否包含必要字段"""
     required_fields = {'cap_area', 'cap_full', 'crop_area_rel', 'crop_area_abs'}
     return all(field in data for field in required_fields)
 
-def find_valid_image_ids(folder_path: str) -> List[str]:
-    """查找所有包含有效元数据的image_id目录"""
-    valid_ids = []
-    for entry in os.scandir(folder_path):
-        if entry.is_dir():
-            meta_path = os.path.join(entry.path, 'image_meta.json')
-            if os.path.exists(meta_path):
-                try:
-                    with open(meta_path, 'r') as f:
-                        data = json.load(f)
-                        if validate_metadata(data):
-                            valid_ids.append(entry.name)
-                except (json.JSONDecodeError, IOError) as e:
-                    print(f"跳过无效元数据文件 {meta_path}: {str(e)}")
-    return valid_ids
-
-def create_merged_csv(app_name: str, image_ids: List[str]) -> str:
-    """创建合并后的CSV文件"""
-    csv_path = os.path.join(app_name, 'merged_data.csv')
-    
-    # 获取统一的app名称
+def find_valid_image_ids(folder_path: str) -> Dict[str, dict]:
+    """并行扫描一次元数据，返回包含有效元数据的 {image_id: 元数据}"""
+    session = open_session(folder_path)
+    records = {image_id: data for image_id, data in session.metas().items() if validate_metadata(data)}
+    session.close()
+    return records
+
+def ask_app_value(app_name: str) -> str:
+    """获取统一的app名称"""
     default_app = os.path.basename(os.path.normpath(app_name))
-    app_value = input(f"请输入应用名称 (默认: {default_app}): ").strip() or default_app
+    return input(f"请输入应用名称 (默认: {default_app}): ").strip() or default_app
 
-    with open(csv_path, 'w', newline='', encoding='utf-8') as csvfile:
+def create_merged_csv(app_name: str, records: Dict[str, dict], app_value: str, append: bool = False) -> str:
+    """创建合并后的CSV文件，append 时只在末尾追加 records 中的行"""
+    csv_path = os.path.join(app_name, 'merged_data.csv')
+
+    with open(csv_path, 'a' if append else 'w', newline='', encoding='utf-8') as csvfile:
         fieldnames = [
             'image_id', 
             'cap_area', 
@@ -44,46 +47,169 @@ def create_merged_csv(app_name: str, image_ids: List[str]) -> str:
             'image_path'
         ]
         writer = csv.DictWriter(csvfile, fieldnames=fieldnames)
-        writer.writeheader()
+        if not append:
+            writer.writeheader()
 
-        for img_id in image_ids:
-            meta_path = os.path.join(app_name, img_id, 'image_meta.json')
-            with open(meta_path, 'r') as f:
-                data = json.load(f)
-                writer.writerow({
-                    'image_id': img_id,
-                    'cap_area': json.dumps(data['cap_area']),
-                    'cap_full': json.dumps(data['cap_full']),
-                    'crop_area_rel': json.dumps(data['crop_area_rel']),
-                    'crop_area_abs': json.dumps(data['crop_area_abs']),
-                    'app': app_value,
-                    'image_path': f"{img_id}/crop_image.jpg"
-                })
+        for img_id, data in records.items():
+            writer.writerow({
+                'image_id': img_id,
+                'cap_area': json.dumps(data['cap_area']),
+                'cap_full': json.dumps(data['cap_full']),
+                'crop_area_rel': json.dumps(data['crop_area_rel']),
+                'crop_area_abs': json.dumps(data['crop_area_abs']),
+                'app': app_value,
+                'image_path': f"{img_id}/crop_image.jpg"
+            })
     return csv_path
 
+def create_columnar_file(app_name: str, records: Dict[str, dict], app_value: str) -> str:
+    """创建与CSV内容相同的列式文件 merged_data.npz：坐标为 int32 (n, 4) 数组，app 名称按字典编码"""
+    npz_path = os.path.join(app_name, 'merged_data.npz')
+    image_ids = list(records)
+    columns = {
+        'image_id': np.array(image_ids, dtype=str),
+        'image_path': np.array([f"{img_id}/crop_image.jpg" for img_id in image_ids], dtype=str),
+        'app': np.zeros(len(image_ids), dtype=np.int32),  # app_names 中的下标
+        'app_names': np.array([app_value], dtype=str)
+    }
+    for field in BBOX_FIELDS:
+        columns[field] = np.array([records[img_id][field] for img_id in image_ids], dtype=np.int32).reshape(-1, 4)
+    with open(npz_path + '.tmp', 'wb') as f:
+        np.savez(f, **columns)  # 不压缩，加载时直接读入数组
+    os.replace(npz_path + '.tmp', npz_path)
+    return npz_path
+
+def load_columns(npz_paths: List[str]) -> Dict[str, np.ndarray]:
+    """加载并拼接多个 merged_data.npz，app 重新编码到合并后的 app_names"""
+    parts = []
+    for path in npz_paths:
+        with np.load(path) as data:
+            parts.append({key: data[key] for key in data.files})
+    app_names = sorted({name for part in parts for name in part['app_names']})
+    lookup = {name: code for code, name in enumerate(app_names)}
+    columns = {
+        key: np.concatenate([part[key] for part in parts]) if parts else np.zeros((0, 4) if key in BBOX_FIELDS else 0)
+        for key in ('image_id', 'image_path') + BBOX_FIELDS
+    }
+    columns['app'] = np.concatenate(
+        [np.array([lookup[name] for name in part['app_names']], dtype=np.int32)[part['app']] for part in parts]
+    ) if parts else np.zeros(0, dtype=np.int32)
+    columns['app_names'] = np.array(app_names, dtype=str)
+    return columns
+
 def create_zip_package(app_name: str, image_ids: List[str]):
-    """创建压缩包并包含必要文件"""
+    """创建压缩包并包含必要文件：图片直接存储，CSV/JSON 并行压缩"""
     zip_filename = f"{app_name}_package.zip"
     base_path = os.path.abspath(app_name)
-    
-    with zipfile.ZipFile(zip_filename, 'w', zipfile.ZIP_DEFLATED) as zipf:
-        # 添加CSV文件
-        csv_path = os.path.join(app_name, 'merged_data.csv')
-        if os.path.exists(csv_path):
-            zipf.write(csv_path, os.path.relpath(csv_path, base_path))
-        
+    entries = []
+
+    # 添加CSV文件和列式文件
+    for merged_file in ('merged_data.csv', 'merged_data.npz'):
+        merged_path = os.path.join(app_name, merged_file)
+        if os.path.exists(merged_path):
+            entries.append(file_entry(merged_path, merged_file))
+
+    session = open_session(app_name)
+    if session.format == "pack":
+        # pack 格式直接从打包文件读取，按目录格式的路径写入压缩包
+        now = time.time()
+        for img_id in image_ids:
+            for name in session.names(img_id):
+                if name.endswith(IMAGE_EXTENSIONS):
+                    entries.append((f"{img_id}/{name}", lambda img_id=img_id, name=name: session.read_bytes(img_id, name), now))
+            entries.append((f"{img_id}/image_meta.json", lambda img_id=img_id: json.dumps(session.read_meta(img_id), indent=4).encode("utf-8"), now))
+    else:
         # 添加图片目录
         for img_id in image_ids:
             img_dir = os.path.join(app_name, img_id)
             for root, _, files in os.walk(img_dir):
                 for file in files:
-                    if file.endswith(('.jpg', '.json')):
+                    if file.endswith(IMAGE_EXTENSIONS + ('.json',)):
                         full_path = os.path.join(root, file)
-                        zipf.write(
-                            full_path, 
-                            os.path.relpath(full_path, base_path)
-                        )
+                        entries.append(file_entry(full_path, os.path.relpath(full_path, base_path).replace(os.sep, "/")))
+
+    stats = write_zip(zip_filename, entries)
+    session.close()
     print(f"已创建压缩包: {os.path.abspath(zip_filename)}")
+    print(f"打包统计: {describe(stats)}")
+
+def record_signature(data: dict) -> str:
+    """CSV 中一行的内容指纹，重新裁剪后会变化"""
+    return json.dumps([data[field] for field in BBOX_FIELDS], separators=(',', ':'))
+
+def load_state(app_name: str) -> dict:
+    try:
+        with open(os.path.join(app_name, STATE_FILE), 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return {}
+
+def save_state(app_name: str, records: Dict[str, dict], app_value: str):
+    """记录本次合并的 app 名称和每个 image_id 的内容指纹"""
+    state = {'app': app_value, 'rows': {img_id: record_signature(data) for img_id, data in records.items()}}
+    state_path = os.path.join(app_name, STATE_FILE)
+    with open(state_path + '.tmp', 'w', encoding='utf-8') as f:
+        json.dump(state, f, separators=(',', ':'))
+    os.replace(state_path + '.tmp', state_path)
+
+def merge_folder(app_name: str, app_value: str = None, package: bool = False, full: bool = False) -> dict:
+    """非交互地合并一个APP目录：只有新增截图时追加到CSV末尾，有截图重新裁剪或被删除时重新生成"""
+    app_value = app_value or os.path.basename(os.path.normpath(app_name))
+    records = find_valid_image_ids(app_name)
+    materialize(app_name, records, workers=1)  # 已经在进程池中，在当前进程生成缺少的裁剪图片
+    state = {} if full else load_state(app_name)
+    rows = state.get('rows', {})
+    added = [img_id for img_id in records if img_id not in rows]
+    changed = [img_id for img_id in records if img_id in rows and rows[img_id] != record_signature(records[img_id])]
+    removed = len(rows) - (len(records) - len(added))
+
+    can_append = (
+        state.get('app') == app_value
+        and not changed and not removed
+        and os.path.exists(os.path.join(app_name, 'merged_data.csv'))
+        and (not rows or not added or min(added) > max(rows))  # 追加后CSV仍按 image_id 排序
+    )
+    if can_append:
+        if added:
+            create_merged_csv(app_name, {img_id: records[img_id] for img_id in added}, app_value, append=True)
+    else:
+        create_merged_csv(app_name, records, app_value)
+    if added or changed or removed or not can_append:
+        create_columnar_file(app_name, records, app_value)
+        save_state(app_name, records, app_value)
+    if package:
+        create_zip_package(app_name, records)
+    return {
+        'folder': app_name, 'rows': len(records), 'added': len(added), 'changed': len(changed),
+        'removed': removed, 'rewritten': not can_append
+    }
+
+def batch_main(argv: List[str]):
+    """批量模式：并行合并多个APP目录"""
+    parser = argparse.ArgumentParser(description="批量合并多个APP目录（增量更新 merged_data.csv / merged_data.npz）")
+    parser.add_argument("folders", nargs="+", help="APP目录，即 ./[base_save_path]/[app_name]")
+    parser.add_argument("--app", help="应用名称，默认使用目录名")
+    parser.add_argument("--zip", action="store_true", help="同时创建压缩包")
+    parser.add_argument("--full", action="store_true", help="忽略上次的合并状态，重新生成")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="并行处理的目录数")
+    args = parser.parse_args(argv)
+
+    folders = [folder for folder in args.folders if os.path.isdir(folder)]
+    for folder in set(args.folders) - set(folders):
+        print(f"错误: 目录 {folder} 不存在")
+    failed = 0
+    with ProcessPoolExecutor(max_workers=args.workers) as pool:
+        futures = {pool.submit(merge_folder, folder, args.app, args.zip, args.full): folder for folder in folders}
+        for future in as_completed(futures):
+            try:
+                result = future.result()
+            except Exception as e:
+                print(f"合并失败 {futures[future]}: {e}")
+                failed += 1
+                continue
+            action = "重新生成" if result['rewritten'] else "追加"
+            print(f"{result['folder']}: {result['rows']} 行 ({action}, 新增 {result['added']}, 重新裁剪 {result['changed']}, 删除 {result['removed']})")
+    return 1 if failed or len(folders) != len(args.folders) else 0
 
 def main():
     app_folder = input("请输入APP目录路径: ").strip()
@@ -98,11 +224,17 @@ def main():
         return
 
     print(f"找到 {len(valid_ids)} 个有效image_id目录")
-    csv_file = create_merged_csv(app_folder, valid_ids)
-    print(f"合并完成 -> {csv_file}")
+    materialize(app_folder, valid_ids)  # crop.py 只记录坐标，生成缺少的裁剪图片
+    app_value = ask_app_value(app_folder)
+    csv_file = create_merged_csv(app_folder, valid_ids, app_value)
+    npz_file = create_columnar_file(app_folder, valid_ids, app_value)
+    save_state(app_folder, valid_ids, app_value)
+    print(f"合并完成 -> {csv_file}, {npz_file}")
 
     if input("是否创建压缩包? (y/n): ").lower() == 'y':
         create_zip_package(app_folder, valid_ids)
 
 if __name__ == "__main__":
+    if len(sys.argv) > 1:
+        sys.exit(batch_main(sys.argv[1:]))
     main()
\ No newline at end of file
@@ -0,0 +1,153 @@
+import json
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import numpy as np
+
+# 录制过程的分阶段耗时统计
+# 每个阶段维护 Prometheus 风格的累计直方图和最近 WINDOW 个样本（用于计算分位数），
+# 定期追加到 JSONL 文件，也可以通过本地 HTTP 端口以 Prometheus 文本格式读取
+
+BUCKETS_MS = (0.1, 0.25, 0.5, 1, 2.5, 5, 10, 25, 50, 100, 250, 500, 1000, 2500)
+WINDOW = 1024
+
+
+class RollingHistogram:
+    """ 单个阶段的耗时直方图 """
+
+    def __init__(self):
+        self.bucket_counts = [0] * (len(BUCKETS_MS) + 1)  # 最后一个为 +Inf
+        self.count = 0
+        self.total = 0.0
+        self.recent = deque(maxlen=WINDOW)
+
+    def observe(self, value_ms):
+        for i, bound in enumerate(BUCKETS_MS):
+            if value_ms <= bound:
+                self.bucket_counts[i] += 1
+                break
+        else:
+            self.bucket_counts[-1] += 1
+        self.count += 1
+        self.total += value_ms
+        self.recent.append(value_ms)
+
+    def summary(self):
+        recent = np.asarray(self.recent) if self.recent else np.zeros(1)
+        p50, p95, p99 = np.percentile(recent, (50, 95, 99))
+        return {
+            "count": self.count,
+            "mean": self.total / self.count if self.count else 0.0,
+            "p50": float(p50),
+            "p95": float(p95),
+            "p99": float(p99),
+            "max": float(recent.max())
+        }
+
+
+class Metrics:
+    """ 线程安全的阶段计时器 """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.histograms = {}
+        self.gauges = {}
+        self._stop = threading.Event()
+        self._threads = []
+        self._server = None
+
+    def observe(self, stage, value_ms):
+        with self._lock:
+            histogram = self.histograms.get(stage)
+            if histogram is None:
+                histogram = self.histograms[stage] = RollingHistogram()
+            histogram.observe(value_ms)
+
+    def set_gauge(self, name, value):
+        with self._lock:
+            self.gauges[name] = value
+
+    @contextmanager
+    def stage(self, name):
+        """ with metrics.stage("encode"): ... """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, (time.perf_counter() - start) * 1000)
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                "time": time.time(),
+                "stages_ms": {name: histogram.summary() for name, histogram in self.histograms.items()},
+                "gauges": dict(self.gauges)
+            }
+
+    def prometheus_text(self):
+        """ 以 Prometheus 文本格式导出 """
+        lines = [
+            "# HELP screen_shot_stage_ms 录制各阶段耗时（毫秒）",
+            "# TYPE screen_shot_stage_ms histogram"
+        ]
+        with self._lock:
+            for name, histogram in sorted(self.histograms.items()):
+                cumulative = 0
+                for bound, count in zip(BUCKETS_MS + ("+Inf",), histogram.bucket_counts):
+                    cumulative += count
+                    lines.append(f'screen_shot_stage_ms_bucket{{stage="{name}",le="{bound}"}} {cumulative}')
+                lines.append(f'screen_shot_stage_ms_sum{{stage="{name}"}} {histogram.total}')
+                lines.append(f'screen_shot_stage_ms_count{{stage="{name}"}} {histogram.count}')
+            for name, value in sorted(self.gauges.items()):
+                lines.append(f"# TYPE screen_shot_{name} gauge")
+                lines.append(f"screen_shot_{name} {value}")
+        return "\n".join(lines) + "\n"
+
+    def write_jsonl(self, path):
+        with open(path, "a", encoding="utf-8") as f:
+            f.write(json.dumps(self.snapshot(), ensure_ascii=False) + "\n")
+
+    def start_jsonl(self, path, interval):
+        """ 每隔 interval 秒把快照追加到 JSONL 文件 """
+        def loop():
+            while not self._stop.wait(interval):
+                self.write_jsonl(path)
+            self.write_jsonl(path)  # 停止时写最后一次
+
+        thread = threading.Thread(target=loop, name="metrics-jsonl", daemon=True)
+        thread.start()
+        self._threads.append(thread)
+
+    def serve(self, port, host="127.0.0.1"):
+        """ 在本地端口提供 /metrics """
+        metrics = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                body = metrics.prometheus_text().encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        self._server = ThreadingHTTPServer((host, port), Handler)
+        thread = threading.Thread(target=self._server.serve_forever, name="metrics-http", daemon=True)
+        thread.start()
+        self._threads.append(thread)
+        print(f"指标服务: http://{host}:{self._server.server_address[1]}/metrics")
+
+    def close(self):
+        self._stop.set()
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+        for thread in self._threads:
+            thread.join()
+        self._threads = []
@@ -0,0 +1,181 @@
+import os
+import sys
+import time
+import zlib
+import struct
+import argparse
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+from session import IMAGE_EXTENSIONS
+
+# 打包引擎：流式写出 ZIP（支持 ZIP64），不需要回写文件头，输出可以是管道
+# - 已经压缩过的图片等文件直接存储（ZIP_STORED），再压缩只会浪费 CPU
+# - 文本 / JSON 在线程池中并行 deflate（zlib 在压缩和计算 CRC 时释放 GIL），读文件也在线程池中进行
+# - 主线程按顺序写出，预读窗口限制内存占用
+
+STORED_SUFFIXES = IMAGE_EXTENSIONS + (".jpeg", ".gif", ".zip", ".gz", ".npz", ".mp4", ".avi", ".pack")
+
+ZIP64_LIMIT = 0xFFFFFFFF        # 超过该值的大小 / 偏移量记录在 ZIP64 扩展字段中
+ZIP64_COUNT_LIMIT = 0xFFFF     # 超过该条目数需要 ZIP64 结束记录
+VERSION_MADE_BY = 3 << 8       # Unix，外部属性中的文件权限才会生效
+METHOD_STORED = 0
+METHOD_DEFLATED = 8
+FLAG_UTF8 = 0x0800
+
+
+def clamp32(value):
+    return 0xFFFFFFFF if value >= ZIP64_LIMIT else value
+
+
+def clamp16(value):
+    return 0xFFFF if value >= ZIP64_COUNT_LIMIT else value
+
+
+def dos_time(mtime):
+    """ ZIP 头中的 DOS 日期和时间 """
+    t = time.localtime(mtime)
+    if t.tm_year < 1980:
+        return 0, (1 << 5) | 1  # 1980-01-01 00:00
+    return (t.tm_hour << 11) | (t.tm_min << 5) | (t.tm_sec // 2), ((t.tm_year - 1980) << 9) | (t.tm_mon << 5) | t.tm_mday
+
+
+def prepare_entry(name, load, mtime, level=6):
+    """ 在线程池中执行：读取数据、计算 CRC，需要时压缩；返回写入需要的全部信息 """
+    data = load()
+    crc = zlib.crc32(data)
+    if name.lower().endswith(STORED_SUFFIXES) or not data:
+        return name, METHOD_STORED, crc, len(data), data, mtime
+    compressor = zlib.compressobj(level, zlib.DEFLATED, -15)  # ZIP 使用不带 zlib 头的原始 deflate 流
+    payload = compressor.compress(data) + compressor.flush()
+    if len(payload) >= len(data):
+        return name, METHOD_STORED, crc, len(data), data, mtime  # 压缩后反而更大
+    return name, METHOD_DEFLATED, crc, len(data), payload, mtime
+
+
+class ZipStreamWriter:
+    """ 只顺序写入的 ZIP 写入器，偏移量和条目数超出 32 位 / 16 位限制时自动使用 ZIP64 """
+
+    def __init__(self, fileobj):
+        self.fileobj = fileobj
+        self.offset = 0
+        self.entries = []  # (文件名字节, 方法, crc, 原始大小, 压缩后大小, 本地头偏移, dos 时间, dos 日期)
+
+    def _write(self, data):
+        self.fileobj.write(data)
+        self.offset += len(data)
+
+    def add(self, name, method, crc, size, payload, mtime):
+        encoded = name.encode("utf-8")
+        clock, date = dos_time(mtime)
+        offset = self.offset
+        zip64 = size >= ZIP64_LIMIT or len(payload) >= ZIP64_LIMIT
+        extra = struct.pack("<HHQQ", 0x0001, 16, size, len(payload)) if zip64 else b""
+        self._write(struct.pack(
+            "<IHHHHHIIIHH", 0x04034B50, 45 if zip64 else 20, FLAG_UTF8, method, clock, date, crc,
+            0xFFFFFFFF if zip64 else len(payload), 0xFFFFFFFF if zip64 else size, len(encoded), len(extra)
+        ))
+        self._write(encoded)
+        self._write(extra)
+        self._write(payload)
+        self.entries.append((encoded, method, crc, size, len(payload), offset, clock, date))
+
+    def close(self):
+        """ 写出中央目录和结束记录 """
+        directory_offset = self.offset
+        for encoded, method, crc, size, compressed, offset, clock, date in self.entries:
+            values = []
+            if size >= ZIP64_LIMIT:
+                values.append(size)
+            if compressed >= ZIP64_LIMIT:
+                values.append(compressed)
+            if offset >= ZIP64_LIMIT:
+                values.append(offset)
+            extra = struct.pack(f"<HH{len(values)}Q", 0x0001, 8 * len(values), *values) if values else b""
+            version = 45 if values else 20
+            self._write(struct.pack(
+                "<IHHHHHHIIIHHHHHII", 0x02014B50, VERSION_MADE_BY | version, version, FLAG_UTF8, method, clock, date, crc,
+                clamp32(compressed), clamp32(size), len(encoded), len(extra), 0, 0, 0, 0o644 << 16, clamp32(offset)
+            ))
+            self._write(encoded)
+            self._write(extra)
+        directory_size = self.offset - directory_offset
+        count = len(self.entries)
+
+        if count >= ZIP64_COUNT_LIMIT or directory_offset >= ZIP64_LIMIT or directory_size >= ZIP64_LIMIT:
+            zip64_offset = self.offset
+            self._write(struct.pack(
+                "<IQHHIIQQQQ", 0x06064B50, 44, VERSION_MADE_BY | 45, 45, 0, 0, count, count, directory_size, directory_offset
+            ))
+            self._write(struct.pack("<IIQI", 0x07064B50, 0, zip64_offset, 1))
+        self._write(struct.pack(
+            "<IHHHHIIH", 0x06054B50, 0, 0, clamp16(count), clamp16(count),
+            clamp32(directory_size), clamp32(directory_offset), 0
+        ))
+        self.fileobj.flush()
+
+
+def file_entry(path, name):
+    """ 磁盘文件对应的条目 (压缩包内路径, 读取函数, 修改时间) """
+    def load():
+        with open(path, "rb") as f:
+            return f.read()
+    return name, load, os.path.getmtime(path)
+
+
+def write_zip(path, entries, workers=8, level=6, lookahead=64):
+    """ 把 [(压缩包内路径, 读取函数, 修改时间)] 写入 path，返回吞吐统计 """
+    stats = {"files": 0, "bytes_in": 0, "bytes_out": 0, "stored": 0, "deflated": 0}
+    started = time.perf_counter()
+    with open(path + ".part", "wb") as f, ThreadPoolExecutor(max_workers=workers) as pool:
+        writer = ZipStreamWriter(f)
+        pending = deque()
+        entries = iter(entries)
+
+        def fill():
+            while len(pending) < lookahead:
+                entry = next(entries, None)
+                if entry is None:
+                    return
+                pending.append(pool.submit(prepare_entry, *entry, level))
+
+        fill()
+        while pending:
+            name, method, crc, size, payload, mtime = pending.popleft().result()
+            fill()
+            writer.add(name, method, crc, size, payload, mtime)
+            stats["files"] += 1
+            stats["bytes_in"] += size
+            stats["stored" if method == METHOD_STORED else "deflated"] += 1
+        writer.close()
+        stats["bytes_out"] = writer.offset
+    os.replace(path + ".part", path)
+    stats["seconds"] = time.perf_counter() - started
+    stats["mb_per_s"] = stats["bytes_out"] / 1e6 / max(stats["seconds"], 1e-9)
+    return stats
+
+
+def describe(stats):
+    return (f"{stats['files']} 个文件 (存储 {stats['stored']}, 压缩 {stats['deflated']}), "
+            f"{stats['bytes_in'] / 1e6:.1f} MB -> {stats['bytes_out'] / 1e6:.1f} MB, "
+            f"{stats['seconds']:.1f} 秒, {stats['mb_per_s']:.1f} MB/秒")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="把文件夹打包为 ZIP（图片直接存储，文本并行压缩）")
+    parser.add_argument("folder")
+    parser.add_argument("output", nargs="?", help="默认 [folder]_package.zip")
+    parser.add_argument("--workers", type=int, default=8)
+    parser.add_argument("--level", type=int, default=6, help="deflate 压缩级别（1-9）")
+    args = parser.parse_args()
+
+    if not os.path.isdir(args.folder):
+        print(f"目录不存在: {args.folder}")
+        sys.exit(1)
+    base = os.path.abspath(args.folder)
+    entries = (
+        file_entry(os.path.join(root, name), os.path.relpath(os.path.join(root, name), base).replace(os.sep, "/"))
+        for root, _, files in os.walk(base) for name in sorted(files)
+    )
+    output = args.output or args.folder.rstrip("/\\") + "_package.zip"
+    print(f"已创建压缩包: {os.path.abspath(output)}, {describe(write_zip(output, entries, args.workers, args.level))}")
@@ -0,0 +1,83 @@
+import threading
+from collections import OrderedDict
+
+# 图片预读：后台线程提前解码并缩放当前图片前后 N 张，放进有上限的 LRU 缓存，翻页时直接取用
+# JPEG 用 PIL draft 按 1/2、1/4、1/8 缩小解码，显示用的副本不需要完整解码 4K 原图
+
+
+def fit_size(original, size):
+    """ 等比缩放到不超过 size 的尺寸 """
+    scale = min(size[0] / original[0], size[1] / original[1])
+    return max(1, int(original[0] * scale)), max(1, int(original[1] * scale))
+
+
+def load_scaled(session, image_id, name, size):
+    """ 打开图片并缩放到适合 size 的显示尺寸，返回 (显示图片, 原图尺寸) """
+    image = session.open_image(image_id, name)
+    original = image.size
+    target = fit_size(original, size)
+    image.draft("RGB", target)  # 只对 JPEG 生效，缩小解码的尺寸不小于 target
+    return image.resize(target), original
+
+
+class ImagePrefetcher:
+    """ load(image_id, size) 在后台线程中执行，结果按 (image_id, size) 缓存 """
+
+    def __init__(self, load, capacity=16):
+        self.load = load
+        self.capacity = capacity
+        self._cache = OrderedDict()
+        self._wanted = []  # 等待预读的 (image_id, size)，按优先级排列
+        self._cond = threading.Condition()
+        self._closed = False
+        self._thread = threading.Thread(target=self._worker, name="image-prefetch", daemon=True)
+        self._thread.start()
+
+    def _store(self, key, value):
+        self._cache[key] = value
+        self._cache.move_to_end(key)
+        while len(self._cache) > self.capacity:
+            self._cache.popitem(last=False)
+
+    def _worker(self):
+        while True:
+            with self._cond:
+                while not self._wanted and not self._closed:
+                    self._cond.wait()
+                if self._closed:
+                    return
+                key = self._wanted.pop(0)
+                if key in self._cache:
+                    continue
+            try:
+                value = self.load(*key)
+            except Exception as e:
+                print(f"预读失败 {key[0]}: {e}")
+                continue
+            with self._cond:
+                self._store(key, value)
+
+    def get(self, image_id, size):
+        """ 取缓存结果，没有时在当前线程中加载 """
+        key = (image_id, size)
+        with self._cond:
+            value = self._cache.get(key)
+            if value is not None:
+                self._cache.move_to_end(key)
+                return value
+        value = self.load(image_id, size)
+        with self._cond:
+            self._store(key, value)
+        return value
+
+    def prefetch(self, image_ids, size):
+        """ 替换预读列表，image_ids 按优先级排列，数量不应超过缓存容量 """
+        with self._cond:
+            self._wanted = [(image_id, size) for image_id in image_ids[:self.capacity - 1]]
+            self._cond.notify()
+
+    def close(self):
+        with self._cond:
+            self._closed = True
+            self._cond.notify()
+        self._thread.join()
@@ -0,0 +1,169 @@
+import io
+import os
+import sys
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+
+import cv2
+import numpy as np
+
+from config import load_config
+from session import PackSession, file_version, init_worker, open_session, worker_session
+
+# 预览金字塔：每张图片按长边 1920 / 960 / 480 / 240 像素保存几级 JPEG 预览，
+# 存放在录制目录下的 .previews/（与 pack 格式相同：previews 数据追加到 session.pack，索引在 session.idx）
+# 预览的键为 "image_id/文件名"，元数据记录原图尺寸、各级尺寸和生成时原图的版本（session.version），
+# 原图重新写入（如重新裁剪后 materialize.py 重新生成 crop_image.jpg）后版本不一致，旧的预览不再使用，preview.py 会重新生成
+# crop.py、fil.py、fliter.py 只加载需要的那一级
+# 录制时开启 record_previews 由写入线程顺带生成，也可以运行 python preview.py [app目录] 用进程池批量生成
+
+PREVIEW_DIR = ".previews"
+SOURCES = ("cap_full_image", "crop_image")  # 生成预览的图片（不含扩展名）
+
+
+def build_pyramid(frame, levels, quality=85):
+    """ frame 为 BGR 图，返回 [(宽, 高, JPEG 字节)]，从大到小逐级缩小 """
+    height, width = frame.shape[:2]
+    params = [int(cv2.IMWRITE_JPEG_QUALITY), quality]
+    pyramid = []
+    current = frame
+    for edge in sorted(levels, reverse=True):
+        scale = edge / max(width, height)
+        if scale >= 1:
+            continue  # 不生成比原图还大的预览
+        size = (max(1, round(width * scale)), max(1, round(height * scale)))
+        current = cv2.resize(current, size, interpolation=cv2.INTER_AREA)  # 用上一级缩小，越往下越便宜
+        pyramid.append((size[0], size[1], cv2.imencode(".jpg", current, params)[1].tobytes()))
+    return pyramid
+
+
+class PreviewStore:
+    """ 一个录制目录的预览金字塔 """
+
+    def __init__(self, app_dir):
+        self.pack = PackSession(os.path.join(app_dir, PREVIEW_DIR))
+
+    def versions(self):
+        """ {键: 生成预览时原图的版本} """
+        return {key: meta.get("version") for key, meta in self.pack.metas().items()}
+
+    def add(self, key, size, pyramid, version):
+        """ 先写图片再写元数据，读取方只会看到完整的金字塔 """
+        self.pack.write(key, {f"{w}x{h}.jpg": data for w, h, data in pyramid})
+        self.pack.write_meta(key, {"size": list(size), "levels": [[w, h] for w, h, _ in pyramid], "version": version})
+
+    def _current(self, key, version):
+        record = self.pack.records.get(key)
+        if record is None or record["meta"] is None or record["meta"].get("version") != version:
+            return None
+        return record["meta"]
+
+    def _meta(self, key, version):
+        """ 按原图当前版本生成的预览元数据，预览过期或不存在时返回 None """
+        meta = self._current(key, version)
+        if meta is None:
+            self.pack.refresh()  # 录制器或 preview.py 可能刚刚写入
+            meta = self._current(key, version)
+        return meta
+
+    def open_scale(self, key, scale, version):
+        """ 返回不小于 原图 * scale 的最小一级预览 (图片, 预览宽 / 原图宽)，没有合适的预览时返回 None """
+        from PIL import Image
+        meta = self._meta(key, version)
+        if meta is None:
+            return None
+        width = meta["size"][0]
+        fitting = [(w, h) for w, h in meta["levels"] if w >= width * scale]
+        if not fitting:
+            return None
+        w, h = min(fitting)
+        image = Image.open(io.BytesIO(self.pack.read_bytes(key, f"{w}x{h}.jpg")))
+        return image, w / width
+
+    def original_size(self, key, version):
+        meta = self._meta(key, version)
+        return tuple(meta["size"]) if meta is not None else None
+
+    def close(self):
+        self.pack.close()
+
+
+class PreviewLookup:
+    """ 按图片路径 [app目录]/[image_id]/[文件名] 查找预览，供 fil.py / fliter.py 使用 """
+
+    def __init__(self):
+        self._stores = {}
+
+    def open_scale(self, path, scale):
+        """ 返回 (图片, 缩放系数)；没有预览或预览已过期时返回 None，由调用方打开原图 """
+        image_dir, name = os.path.split(os.path.normpath(path))
+        app_dir, image_id = os.path.split(image_dir)
+        if app_dir not in self._stores:
+            exists = os.path.exists(os.path.join(app_dir, PREVIEW_DIR, "session.idx"))
+            self._stores[app_dir] = PreviewStore(app_dir) if exists else None
+        store = self._stores[app_dir]
+        if store is None:
+            return None
+        return store.open_scale(f"{image_id}/{name}", scale, file_version(path))
+
+    def close(self):
+        for store in self._stores.values():
+            if store is not None:
+                store.close()
+
+
+def render(job):
+    """ 进程池中执行：返回 (键, 原图尺寸, 金字塔) """
+    from PIL import Image
+    image_id, name, levels, quality = job
+    data = worker_session().read_bytes(image_id, name)
+    size = Image.open(io.BytesIO(data)).size  # 只读文件头
+    # JPEG 可以按 1/2、1/4、1/8 缩小解码，只要不小于最大一级预览
+    flag = cv2.IMREAD_COLOR
+    for factor, reduced in ((8, cv2.IMREAD_REDUCED_COLOR_8), (4, cv2.IMREAD_REDUCED_COLOR_4), (2, cv2.IMREAD_REDUCED_COLOR_2)):
+        if max(size) / factor >= max(levels):
+            flag = reduced
+            break
+    frame = cv2.imdecode(np.frombuffer(data, dtype=np.uint8), flag)
+    pyramid = build_pyramid(frame, levels, quality)
+    return f"{image_id}/{name}", size, pyramid
+
+
+def generate(app_dir, levels, quality=85, workers=None):
+    """ 为录制目录中还没有预览或预览已过期的图片生成预览，返回新生成的数量 """
+    session = open_session(app_dir)
+    store = PreviewStore(app_dir)
+    existing = store.versions()
+    versions = {}
+    jobs = []
+    for image_id in session.image_ids():
+        for stem in SOURCES:
+            name = session.find(image_id, stem)
+            if name is None:
+                continue
+            key = f"{image_id}/{name}"
+            versions[key] = session.version(image_id, name)
+            if existing.get(key) != versions[key]:
+                jobs.append((image_id, name, tuple(levels), quality))
+    session.close()
+
+    with ProcessPoolExecutor(max_workers=workers or os.cpu_count() or 1, initializer=init_worker, initargs=(app_dir,)) as pool:
+        for done, (key, size, pyramid) in enumerate(pool.map(render, jobs, chunksize=16), 1):
+            store.add(key, size, pyramid, versions[key])
+            if done % 500 == 0:
+                print(f"已生成 {done}/{len(jobs)}")
+    store.close()
+    return len(jobs)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="为录制目录生成预览金字塔")
+    parser.add_argument("app_dir", help="录制目录，即 ./[base_save_path]/[app_name]")
+    parser.add_argument("--workers", type=int, help="进程数，默认使用全部 CPU")
+    args = parser.parse_args()
+
+    if not os.path.isdir(args.app_dir):
+        print(f"目录不存在: {args.app_dir}")
+        sys.exit(1)
+    config = load_config()
+    print(f"已生成 {generate(args.app_dir, config['preview_levels'], config['preview_quality'], args.workers)} 张图片的预览")
@@ -0,0 +1,105 @@
+import os
+import sys
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+
+import cv2
+import numpy as np
+
+from delta import dirty_regions
+from session import init_worker, open_session, worker_session
+
+# 裁剪建议：按 image_id 顺序把每张 cap_full_image 与前一张比较，新出现的界面区域即为建议的裁剪区域
+# 1. 进程池中按 1/2 缩小解码为灰度图，用 delta.dirty_regions 找出按格子对齐的变化区域
+# 2. 忽略比最大变化区域小很多的零散变化（时钟、光标等），其余区域的外接矩形作为建议；
+#    变化面积过大（切换页面）或没有前一张时建议整张截图
+# 3. 建议写入元数据 crop_proposal_rel [x, y, 宽, 高]（相对 cap_full_image），crop.py 打开时预先画出，确认即可
+
+TILE = 16               # 缩小后灰度图上的格子大小，相当于原图 32 像素
+MIN_DIFF = 8            # 灰度差超过该值视为变化
+MIN_REGION_RATIO = 0.1  # 面积小于最大变化区域该比例的区域不计入建议
+FULL_RATIO = 0.6        # 建议区域超过整张截图该比例时直接建议整张截图
+
+
+def propose_rect(previous, current, size, tile=TILE, min_diff=MIN_DIFF):
+    """ previous / current 为缩小后的灰度图，size 为原图 (宽, 高)，返回原图坐标 [x, y, 宽, 高]，没有变化时返回 None """
+    width, height = size
+    regions = dirty_regions(previous, current, tile, min_diff)
+    if not regions:
+        return None
+    largest = max(w * h for _, _, w, h in regions)
+    kept = np.array([region for region in regions if region[2] * region[3] >= MIN_REGION_RATIO * largest])
+    x0, y0 = kept[:, 0].min(), kept[:, 1].min()
+    x1, y1 = (kept[:, 0] + kept[:, 2]).max(), (kept[:, 1] + kept[:, 3]).max()
+    if (x1 - x0) * (y1 - y0) > FULL_RATIO * current.size:
+        return [0, 0, width, height]
+    # 缩小解码的尺寸向上取整，按比例换算回原图坐标
+    fx = width / current.shape[1]
+    fy = height / current.shape[0]
+    left, top = int(x0 * fx), int(y0 * fy)
+    return [left, top, min(width, int(np.ceil(x1 * fx))) - left, min(height, int(np.ceil(y1 * fy))) - top]
+
+
+def load_gray(image_id):
+    session = worker_session()
+    name = session.find(image_id, 'cap_full_image') if image_id is not None else None
+    if name is None:
+        return None  # 没有前一张，或增量截图尚未恢复
+    return cv2.imdecode(np.frombuffer(session.read_bytes(image_id, name), dtype=np.uint8), cv2.IMREAD_REDUCED_GRAYSCALE_2)
+
+
+def propose_pairs(jobs):
+    """ 进程池中执行：jobs 为 [(前一张 image_id 或 None, image_id, 原图尺寸)]，返回 [(image_id, 建议区域)]
+    相邻的任务共用解码结果，每张图片只解码一次 """
+    results = []
+    decoded = {}
+    for previous_id, image_id, size in jobs:
+        previous = decoded[previous_id] if previous_id in decoded else load_gray(previous_id)
+        current = load_gray(image_id)
+        decoded = {image_id: current}
+        if current is None:
+            continue
+        rect = propose_rect(previous, current, size)
+        if rect is not None:
+            results.append((image_id, rect))
+    return results
+
+
+def propose(app_dir, workers=None, force=False, chunk=64):
+    """ 为还没有裁剪、也没有建议的截图生成裁剪建议，force 时重新生成全部建议，返回写入的建议数 """
+    session = open_session(app_dir)
+    metas = session.metas()
+    jobs = []
+    previous = None
+    for image_id, meta in metas.items():
+        if meta.get("duplicate_of"):
+            continue  # 与 crop.py 一致，重复截图不参与裁剪，也不作为前一张
+        if force or ("crop_area_rel" not in meta and "crop_proposal_rel" not in meta):
+            jobs.append((previous, image_id, tuple(meta["cap_full"][2:])))
+        previous = image_id
+
+    chunks = [jobs[i:i + chunk] for i in range(0, len(jobs), chunk)]
+    proposed = 0
+    full = 0
+    with ProcessPoolExecutor(max_workers=workers or os.cpu_count() or 1, initializer=init_worker, initargs=(app_dir,)) as pool:
+        for results in pool.map(propose_pairs, chunks):
+            for image_id, rect in results:
+                session.update_meta(image_id, {"crop_proposal_rel": rect})
+                proposed += 1
+                full += rect == [0, 0, *metas[image_id]["cap_full"][2:]]
+    print(f"已生成 {proposed} 个裁剪建议（其中整张截图 {full} 个），共检查 {len(jobs)} 张截图")
+    session.close()
+    return proposed
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="比较相邻截图，为 crop.py 生成裁剪建议")
+    parser.add_argument("app_dir", help="录制目录，即 ./[base_save_path]/[app_name]")
+    parser.add_argument("--workers", type=int, help="进程数，默认使用全部 CPU")
+    parser.add_argument("--force", action="store_true", help="重新生成已有的建议（已裁剪的截图也生成）")
+    args = parser.parse_args()
+
+    if not os.path.isdir(args.app_dir):
+        print(f"目录不存在: {args.app_dir}")
+        sys.exit(1)
+    propose(args.app_dir, workers=args.workers, force=args.force)
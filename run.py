@@ -1,55 +1,48 @@
 import cv2
-import pyautogui
 import time
 import os
 import tkinter as tk
 from tkinter import messagebox, simpledialog
-import json
-import yaml
-from datetime import datetime
-from azure.storage.blob import BlobServiceClient
-from skimage.metrics import structural_similarity as ssim
-import pygetwindow as gw
+try:
+    import pygetwindow as gw
+except NotImplementedError:  # pygetwindow 不支持 Linux，此时只能使用传入的窗口对象（如合成截图源）
+    gw = None
 import keyboard
 import mouse
-import numpy as np
-from collections import deque
-
-CONFIG_FILE = "config.yaml"
-
-# 加载和保存配置
-def load_config():
-    try:
-        with open(CONFIG_FILE, "r") as file: # yaml
-            config = yaml.safe_load(file)
-            return config
-            
-    except FileNotFoundError:
-        default_config = {
-            "base_save_path": "screenshots",
-            "azure_sas_url": "",
-            "container_name": "",
-            "threshold": 0.995,
-            "upload_to_cloud": False,
-            "capture_mode": "auto",
-            "auto_screenshot_interval": 0.5, # x秒没有截屏就自动截屏
-            "min_screenshot_interval": 0.1,  # 最短的截屏间隔是y秒
-            "recent_screenshots_count": 5,   # 最近的k张截图
-            "jpeg_quality": 100               # JPEG压缩质量（0-100）
-        }
-        with open(CONFIG_FILE, "w") as file:
-            yaml.dump(default_config, file)
-        return default_config
+import imagecodec
+from preview import PreviewStore, build_pyramid
+from capture import create_backend
+from dedup import create_detector
+from writer import FrameWriter
+from scheduler import CaptureScheduler
+from delta import DeltaTracker
+from metrics import Metrics
+from session import ImageIdGenerator, open_session
+from upload import SessionUploader, create_store
+from config import clean_folder_name, load_config
 
 # 录制器类
 class AppUsageRecorder:
-    def __init__(self, app_window, save_folder_name, config):
-        windows = gw.getWindowsWithTitle(app_window)
-        if not windows:
-            raise ValueError(f"未找到窗口: {app_window}")
-        
-        self.app_window = windows[0]  # 选择第一个匹配的窗口
-        self.app_window.activate()  # 激活窗口，确保它可见
+    def __init__(self, app_window, save_folder_name, config, backend=None, forward=None, activate=True):
+        if isinstance(app_window, str):
+            windows = gw.getWindowsWithTitle(app_window) if gw else []
+            if not windows:
+                raise ValueError(f"未找到窗口: {app_window}")
+            self.app_window = windows[0]  # 选择第一个匹配的窗口
+        else:
+            self.app_window = app_window  # 直接传入窗口对象（如 SyntheticWindow）
+        # 同时录制多个窗口时不能激活，否则各进程互相抢焦点，用户的输入也会落到别的窗口
+        self.activate = activate
+        if activate:
+            self.app_window.activate()  # 激活窗口，确保它可见
+
+        # 截图后端，grab 结果写入复用缓冲区，保存前需要自行 copy
+        self.backend = backend or create_backend(config["capture_backend"], config["capture_monitor"])
+        self.metrics = Metrics()  # 各阶段耗时统计
+        self.backend.metrics = self.metrics
+        self.metrics_file = config["metrics_file"]
+        self.metrics_interval = config["metrics_interval"]
+        self.metrics_port = config["metrics_port"]
 
         self.base_save_path = os.path.join(config["base_save_path"], save_folder_name)
         # self.save_path_full = os.path.join(self.base_save_path, save_folder_name, "full_screen")
@@ -64,71 +57,208 @@ class AppUsageRecorder:
         self.min_screenshot_interval = config["min_screenshot_interval"]
         self.recent_screenshots_count = config["recent_screenshots_count"]
         self.jpeg_quality = config["jpeg_quality"]
-        self.recent_frames = deque(maxlen=self.recent_screenshots_count)
-        self.blob_service_client = BlobServiceClient(account_url=self.azure_sas_url) if self.azure_sas_url else None
+        self.area_codec = imagecodec.codec_settings(config, "area_codec")
+        self.full_codec = imagecodec.codec_settings(config, "full_codec")
+        self.single_grab = config["single_grab"]
+        self.dedup = create_detector(config)
         self.collection_count = 0
+        self.delta_storage = config["delta_storage"]
+        self.delta = DeltaTracker(keyframe_interval=config["keyframe_interval"], ext=imagecodec.extension(self.full_codec))
+        self.scheduler = CaptureScheduler(
+            self.auto_screenshot_interval,
+            self.min_screenshot_interval,
+            auto=self.capture_mode == "auto"
+        )
+        self.writer = FrameWriter(
+            self.save_capture,
+            workers=config["writer_workers"],
+            queue_size=config["writer_queue_size"],
+            policy=config["writer_policy"]
+        )
 
-        if not os.path.exists(self.base_save_path):
-            os.makedirs(self.base_save_path)
+        # forward(image_id, blobs, meta) 不为空时只编码不写盘，由调用方保存（见 supervisor.py）
+        self.forward = forward
+        self.image_ids = ImageIdGenerator()
+
+        # dir: 每张截图一个目录；pack: 追加写入 session.pack / session.idx
+        self.session = open_session(self.base_save_path, config["storage_format"]) if forward is None else None
+
+        # 预览金字塔，由写入线程用内存中的截图生成，不需要再解码
+        self.previews = PreviewStore(self.base_save_path) if config["record_previews"] and forward is None else None
+        self.preview_levels = config["preview_levels"]
+        self.preview_quality = config["preview_quality"]
+
+        # 后台上传，写入线程保存完截图后入队
+        self.uploader = None
+        if self.upload_to_cloud and forward is None:
+            self.uploader = SessionUploader(
+                self.session,
+                create_store(config),
+                save_folder_name,
+                workers=config["upload_workers"],
+                max_retries=config["upload_max_retries"]
+            )
+            self.uploader.start()
 
         # if not os.path.exists(self.save_path_full):
         #     os.makedirs(self.save_path_full)
         # if not os.path.exists(self.save_path_app):
         #     os.makedirs(self.save_path_app)
 
-    def capture_window(self):
-        """ 只截取目标窗口，返回彩色截图 """
-        try:
-            if self.app_window.isMinimized:  # 如果窗口最小化，则恢复
+    def window_area(self):
+        """ 确保目标窗口可见，返回窗口区域 (x, y, width, height) """
+        with self.metrics.stage("window_query"):
+            # activate 为 False 时不改变窗口状态，直接截取窗口当前所在的区域
+            if self.activate and self.app_window.isMinimized:  # 如果窗口最小化，则恢复
                 self.app_window.restore()
-            if not self.app_window.isActive:  # 如果窗口未激活，尝试激活
+            if self.activate and not self.app_window.isActive:  # 如果窗口未激活，尝试激活
                 try:
                     self.app_window.activate()
                 except Exception as e:
                     print(f"窗口激活失败: {e}, 继续截图")
             
-            x, y, width, height = (
+            return (
                 self.app_window.left, 
                 self.app_window.top, 
                 self.app_window.width, 
                 self.app_window.height
             )
-            screenshot = pyautogui.screenshot(region=(x, y, width, height))
-            frame = np.array(screenshot)  # 保持彩色图像
-            frame = cv2.cvtColor(frame, cv2.COLOR_RGB2BGR)  # 转换为 OpenCV BGR 格式
+
+    def capture_window(self):
+        """ 只截取目标窗口，返回彩色截图 """
+        try:
+            x, y, width, height = self.window_area()
+            frame = self.backend.grab((x, y, width, height))  # 直接得到 OpenCV BGR 格式
             return frame, (x, y, width, height)
         except Exception as e:
             print(f"窗口捕获失败: {e} 捕获全屏替代")
-            screenshot = pyautogui.screenshot()
-            frame = np.array(screenshot)
-            frame = cv2.cvtColor(frame, cv2.COLOR_RGB2BGR)
-            return frame, (0, 0, frame.shape[1], frame.shape[0])
+            return self.capture_full_screen()
 
     def capture_full_screen(self):
-        """ 截取全屏，返回彩色截图 """
-        screenshot = pyautogui.screenshot()
-        frame = np.array(screenshot)
-        frame = cv2.cvtColor(frame, cv2.COLOR_RGB2BGR)
-        return frame, (0, 0, frame.shape[1], frame.shape[0])
+        """ 截取全屏，返回彩色截图和全屏区域；区域使用屏幕坐标，非主显示器的原点不是 (0, 0) """
+        frame = self.backend.grab()
+        screen_x, screen_y, _, _ = self.backend.screen_area()
+        return frame, (screen_x, screen_y, frame.shape[1], frame.shape[0])
+
+    def capture_frames(self):
+        """ 只截一次全屏，窗口截图是全屏帧上的 NumPy 视图，两者来自同一时刻
+        先恢复 / 激活窗口并读取窗口区域再截图，全屏帧中的窗口与读取的区域一致 """
+        try:
+            window = self.window_area()
+        except Exception as e:
+            print(f"窗口区域获取失败: {e} 使用全屏替代")
+            window = None
+        full_frame, full_frame_area = self.capture_full_screen()
+        if window is None:
+            return full_frame, full_frame_area, full_frame, full_frame_area
+        x, y, width, height = window
+        screen_x, screen_y, _, _ = full_frame_area
+
+        # 窗口可能部分超出屏幕，裁剪到全屏帧范围内
+        left = min(max(x - screen_x, 0), full_frame.shape[1])
+        top = min(max(y - screen_y, 0), full_frame.shape[0])
+        right = min(max(x - screen_x + width, left), full_frame.shape[1])
+        bottom = min(max(y - screen_y + height, top), full_frame.shape[0])
+        if right == left or bottom == top:
+            print("窗口不在屏幕范围内，使用全屏替代")
+            return full_frame, full_frame_area, full_frame, full_frame_area
+
+        frame = full_frame[top:bottom, left:right]
+        frame_area = (left + screen_x, top + screen_y, right - left, bottom - top)
+        return frame, frame_area, full_frame, full_frame_area
 
     def is_duplicate(self, current_frame):
         """ 判断当前截图是否与最近的 k 张截图重复 """
-        gray_current_frame = cv2.cvtColor(current_frame, cv2.COLOR_BGR2GRAY)
-        for recent_frame in list(self.recent_frames):  # 创建 deque 的副本进行迭代
-            gray_recent_frame = cv2.cvtColor(recent_frame, cv2.COLOR_BGR2GRAY)
-            try:
-                similarity = ssim(gray_recent_frame, gray_current_frame)
-            except Exception as e:
-                similarity = 0
-
-            if similarity > self.threshold:
-                return True
-        return False
-
-    def save_frame(self, frame, path, name):
-        filename = os.path.join(path, f"{name}.jpg")
-        cv2.imwrite(filename, frame, [int(cv2.IMWRITE_JPEG_QUALITY), self.jpeg_quality])
-        return filename
+        return self.dedup.is_duplicate(self.dedup.fingerprint(current_frame))
+
+    def encode_frame(self, frame, settings):
+        """ 按编码设置编码为字节 """
+        with self.metrics.stage("encode"):
+            return imagecodec.encode(frame, settings)
+
+    def encode_capture(self, job):
+        """ 编码一次截图，返回 {文件名: 字节} """
+        meta = job["meta"]
+        if "delta_files" in meta:
+            # 增量截图只保存变化区域，完整图片可以用 delta.py 从关键帧恢复
+            return {
+                name: self.encode_frame(job["cap_full_image"][y:y + h, x:x + w], self.full_codec)
+                for (x, y, w, h), name in zip(meta["dirty_regions"], meta["delta_files"])
+            }
+        return {
+            'cap_area_image' + imagecodec.extension(self.area_codec): self.encode_frame(job["cap_area_image"], self.area_codec),
+            'cap_full_image' + imagecodec.extension(self.full_codec): self.encode_frame(job["cap_full_image"], self.full_codec)
+        }
+
+    def save_capture(self, job):
+        """ 在写入线程中编码并保存一次截图及其元数据 """
+        blobs = self.encode_capture(job)
+        if self.forward is not None:
+            self.forward(job["image_id"], blobs, job["meta"])
+            return
+        with self.metrics.stage("file_write"):
+            self.session.write(job["image_id"], blobs)
+        with self.metrics.stage("meta_write"):
+            self.session.write_meta(job["image_id"], job["meta"])
+        if self.previews is not None and "delta_files" not in job["meta"]:
+            with self.metrics.stage("preview"):
+                frame = job["cap_full_image"]
+                name = 'cap_full_image' + imagecodec.extension(self.full_codec)
+                pyramid = build_pyramid(frame, self.preview_levels, self.preview_quality)
+                version = self.session.version(job["image_id"], name)
+                self.previews.add(f"{job['image_id']}/{name}", (frame.shape[1], frame.shape[0]), pyramid, version)
+        if self.uploader is not None:
+            self.uploader.enqueue(job["image_id"])
+
+    def take_screenshot(self, reason):
+        """ 截图并去重，非重复的截图交给写入线程池保存 """
+        with self.metrics.stage("capture_total"):
+            self._take_screenshot(reason)
+        self.metrics.set_gauge("writer_queue_depth", self.writer.depth())
+        self.metrics.set_gauge("saved_total", self.collection_count)
+        self.metrics.set_gauge("dedup_history_frames", len(self.dedup))
+        self.metrics.set_gauge("dedup_memory_bytes", self.dedup.memory_usage())
+
+    def _take_screenshot(self, reason):
+        if self.single_grab:
+            frame, frame_area, full_frame, full_frame_area = self.capture_frames()
+        else:
+            frame, frame_area = self.capture_window()
+            full_frame, full_frame_area = self.capture_full_screen()
+        
+        with self.metrics.stage("dedup"):
+            fingerprint = self.dedup.fingerprint(frame) if frame is not None else None
+            duplicate = fingerprint is None or self.dedup.is_duplicate(fingerprint)
+        if not duplicate:
+            timestamp = self.image_ids.next()
+            meta_data = {
+                "image_id": timestamp,
+                "cap_area": frame_area,
+                "cap_full": full_frame_area
+            }
+            with self.metrics.stage("delta"):
+                delta = self.delta.track(timestamp, cv2.cvtColor(full_frame, cv2.COLOR_BGR2GRAY))
+            if self.delta_storage:
+                meta_data.update(delta)
+            else:
+                meta_data["dirty_regions"] = delta["dirty_regions"]
+            job = {
+                "image_id": timestamp,
+                "cap_area_image": frame.copy(),  # 截图缓冲区会被下一次截图复用
+                "cap_full_image": full_frame.copy(),
+                "meta": meta_data
+            }
+            if not self.writer.submit(job):
+                print(f"{reason} - 写入队列已满，丢弃截图")
+                return
+
+            # 截图确实会被保存后才更新去重历史和增量基准
+            self.delta.commit()
+            self.dedup.add(fingerprint)
+            print(f"{reason} - 截图保存成功 {self.collection_count} (写入队列: {self.writer.depth()})")
+            self.collection_count += 1
+        else:
+            print(f"{reason} - 截图重复，跳过")
 
     def start_recording(self, duration=30):
         """ 自动录制：只有 UI 变化时才截图 """
@@ -138,52 +268,47 @@ class AppUsageRecorder:
 
         def stop_callback():
             self.stop_recording = True
+            self.scheduler.stop()
             print("录制停止信号收到")
         
-        keyboard.add_hotkey("F10", stop_callback)
-        
-        last_screenshot_time = time.time()
+        self.start_metrics()
 
-        def take_screenshot(reason):
-            frame, frame_area = self.capture_window()
-            full_frame, full_frame_area = self.capture_full_screen()
-            
-            if frame is not None and not self.is_duplicate(frame):
-                timestamp = datetime.now().strftime("%Y%m%d%H%M%S")
-                save_path = os.path.join(self.base_save_path, timestamp)
-                os.makedirs(save_path, exist_ok=True)
-                self.save_frame(frame, save_path,'cap_area_image')
-                self.save_frame(full_frame, save_path,'cap_full_image')
-                meta_data = {
-                    "image_id": timestamp,
-                    "cap_area": frame_area,
-                    "cap_full": full_frame_area
-                }
-                with open(os.path.join(save_path, f"image_meta.json"), "w") as file:
-                    json.dump(meta_data, file)
-
-                self.recent_frames.append(frame)
-                print(f"{reason} - 截图保存成功 {self.collection_count}")
-                self.collection_count += 1
-            else:
-                print(f"{reason} - 截图重复，跳过")
-        
-        while not self.stop_recording:
-            current_time = time.time()
-            if current_time - last_screenshot_time >= self.auto_screenshot_interval:
-                take_screenshot("时间间隔")
-                last_screenshot_time = current_time
-            elif keyboard.is_pressed("F9"):
-                take_screenshot("手动截图")
-                time.sleep(self.min_screenshot_interval)  
-            elif mouse.is_pressed():
-                take_screenshot("鼠标活动")
-                time.sleep(self.min_screenshot_interval)
-            
-            time.sleep(0.05)
-        
+        # 键鼠钩子只登记触发，由调度器决定何时截图
+        hooks = [
+            (keyboard.remove_hotkey, keyboard.add_hotkey("F10", stop_callback)),
+            (keyboard.unhook, keyboard.on_press_key("F9", lambda event: self.scheduler.trigger("手动截图"))),
+            (mouse.unhook, mouse.on_button(lambda: self.scheduler.trigger("鼠标活动"), types=(mouse.DOWN, mouse.UP)))
+        ]
+        try:
+            self.scheduler.run(self.take_screenshot)
+        finally:
+            for remove, hook in hooks:
+                remove(hook)
+        self.close()
         print("录制结束")
 
+    def start_metrics(self):
+        """ 按配置启动耗时统计的 JSONL 输出和 /metrics 服务 """
+        if self.metrics_file:
+            self.metrics.start_jsonl(os.path.join(self.base_save_path, self.metrics_file), self.metrics_interval)
+        if self.metrics_port:
+            self.metrics.serve(self.metrics_port)
+
+    def close(self):
+        """ 写完剩余截图并释放截图后端、存储和上传器 """
+        print(f"等待写入队列清空 ({self.writer.depth()})")
+        self.writer.close()
+        if self.uploader is not None:
+            print("等待上传完成")
+            self.uploader.close()
+            print(f"上传结果: {self.uploader.stats}")
+        self.backend.close()
+        if self.session is not None:
+            self.session.close()
+        if self.previews is not None:
+            self.previews.close()
+        self.metrics.close()
+
 if __name__ == "__main__":
     root = tk.Tk()
     root.title("输入配置信息")
@@ -201,10 +326,7 @@ if __name__ == "__main__":
     
     def select_window(window_name):
         save_folder_name = simpledialog.askstring("文件夹名称", "请输入保存截图的文件夹名称:(不允许包含中文!!!)", initialvalue=window_name)
-        # 需要修改save_folder_name 去掉一些不合法的字符 和空格
-        save_folder_name = ''.join([i for i in save_folder_name if not '\u4e00' <= i <= '\u9fff'])
-        save_folder_name = save_folder_name.replace("\\", "_").replace("/", "_").replace(":", "_").replace("*", "_").replace("?", "_").replace('"', "_").replace("<", "_").replace(">", "_").replace("|", "_").removeprefix(" ").removesuffix(" ").replace(" ", "_")
-        # 自动删去中文字符
+        save_folder_name = clean_folder_name(save_folder_name)
         if not save_folder_name:
             messagebox.showerror("错误", "文件夹名称不能为空")
             return
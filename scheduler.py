@@ -0,0 +1,68 @@
+import threading
+import time
+
+# 事件驱动的截图调度：键鼠钩子回调只负责登记触发，调度线程按单调时钟计算下一次截图时间，
+# 没有事件时阻塞在条件变量上，不再轮询
+
+AUTO_REASON = "时间间隔"
+
+
+class CaptureScheduler:
+    """ 合并触发事件并保证截图间隔：
+    - 两次截图之间至少间隔 min_interval 秒，期间的触发会合并成一次
+    - 自动模式下距上次截图 auto_interval 秒没有截图则自动截图 """
+
+    def __init__(self, auto_interval, min_interval, auto=True, clock=time.monotonic):
+        self.auto_interval = auto_interval
+        self.min_interval = min_interval
+        self.auto = auto
+        self.clock = clock
+        self._cond = threading.Condition()
+        self._pending = None  # 等待执行的触发原因
+        self._stopped = False
+        self.last_capture = None  # 上一次截图开始的时间
+
+    def trigger(self, reason):
+        """ 登记一次截图请求，可以在任意线程（如键鼠钩子）中调用 """
+        with self._cond:
+            if self._pending is None:
+                self._pending = reason
+                self._cond.notify()
+
+    def stop(self):
+        with self._cond:
+            self._stopped = True
+            self._cond.notify()
+
+    @property
+    def stopped(self):
+        return self._stopped
+
+    def next_reason(self):
+        """ 阻塞到下一次应当截图的时刻，返回触发原因；调度停止时返回 None """
+        with self._cond:
+            while not self._stopped:
+                now = self.clock()
+                earliest = self.last_capture + self.min_interval
+                if self._pending is not None and now >= earliest:
+                    reason, self._pending = self._pending, None
+                    return reason
+
+                deadline = self.last_capture + self.auto_interval if self.auto else None
+                if deadline is not None and now >= deadline:
+                    return AUTO_REASON
+
+                if self._pending is not None:
+                    deadline = earliest if deadline is None else min(deadline, earliest)
+                self._cond.wait(None if deadline is None else deadline - now)
+            return None
+
+    def run(self, callback):
+        """ 在当前线程中循环执行 callback(reason)，直到 stop 被调用 """
+        self.last_capture = self.clock()
+        while True:
+            reason = self.next_reason()
+            if reason is None:
+                return
+            self.last_capture = self.clock()  # 按截图开始时间计时，截图耗时不会累积成漂移
+            callback(reason)
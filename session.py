@@ -0,0 +1,421 @@
+import io
+import os
+import sys
+import json
+import mmap
+import shutil
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+if os.name == "nt":
+    import msvcrt
+else:
+    import fcntl
+
+# 录制结果的存储格式
+# - dir:  每张截图一个 [image_id]/ 目录，包含若干图片和 image_meta.json（原有格式）
+# - pack: 只追加的 session.pack（图片数据）+ session.idx（每行一条 JSON 索引记录），
+#         读取时通过 mmap 直接取出图片字节，避免成千上万个小文件
+# crop.py / merge.py 通过 open_session 读取两种格式
+
+META_FILE = "image_meta.json"
+IMAGE_EXTENSIONS = (".jpg", ".webp", ".png")  # 图片格式由编码设置决定
+MANIFEST_FILE = ".meta_manifest.json"  # dir 格式的元数据缓存: image_id -> [mtime_ns, size, meta]
+PACK_FILE = "session.pack"
+INDEX_FILE = "session.idx"
+LOCK_FILE = ".session.lock"  # 跨进程写入锁，录制器、preview.py、materialize.py 等可能同时写同一个目录
+
+
+class FileLock:
+    """ 跨进程互斥锁：每次加锁时打开锁文件并加独占锁，同一进程内的不同实例之间也互斥 """
+
+    def __init__(self, path):
+        self.path = path
+        self._file = None
+        self._thread_lock = threading.Lock()  # 同一实例被多个线程使用时先在进程内排队
+
+    def __enter__(self):
+        self._thread_lock.acquire()
+        self._file = open(self.path, "a+b")
+        if os.name == "nt":
+            self._file.seek(0)
+            while True:
+                try:
+                    msvcrt.locking(self._file.fileno(), msvcrt.LK_LOCK, 1)  # LK_LOCK 重试 10 秒后仍失败会抛出 OSError
+                    break
+                except OSError:
+                    continue
+        else:
+            fcntl.flock(self._file.fileno(), fcntl.LOCK_EX)
+        return self
+
+    def __exit__(self, *exc):
+        if os.name == "nt":
+            self._file.seek(0)
+            msvcrt.locking(self._file.fileno(), msvcrt.LK_UNLCK, 1)
+        else:
+            fcntl.flock(self._file.fileno(), fcntl.LOCK_UN)
+        self._file.close()
+        self._file = None
+        self._thread_lock.release()
+
+
+def file_version(path):
+    """ 文件内容的版本 [修改时间, 大小]，重新写入后改变 """
+    stat = os.stat(path)
+    return [stat.st_mtime_ns, stat.st_size]
+
+
+class ImageIdGenerator:
+    """ 生成按时间单调递增、精确到微秒的 image_id，同一秒内的多张截图不会互相覆盖 """
+
+    def __init__(self):
+        self._last = None
+        self._lock = threading.Lock()
+
+    def next(self, now=None):
+        with self._lock:
+            now = now or datetime.now()
+            if self._last is not None and now <= self._last:
+                now = self._last + timedelta(microseconds=1)
+            self._last = now
+            return now.strftime("%Y%m%d%H%M%S%f")
+
+
+class DirSession:
+    """ 每张截图一个目录的存储格式 """
+
+    format = "dir"
+
+    def __init__(self, path):
+        self.path = path
+        os.makedirs(path, exist_ok=True)
+        self._file_lock = FileLock(os.path.join(path, LOCK_FILE))
+
+    def image_dir(self, image_id):
+        return os.path.join(self.path, image_id)
+
+    def image_ids(self):
+        """ 按 image_id 排序返回所有包含元数据的截图 """
+        return sorted(
+            entry.name for entry in os.scandir(self.path)
+            if entry.is_dir() and os.path.exists(os.path.join(entry.path, META_FILE))
+        )
+
+    def has(self, image_id, name):
+        return os.path.exists(os.path.join(self.path, image_id, name))
+
+    def metas(self, workers=16):
+        """ 用线程池并行读取所有截图的元数据，返回按 image_id 排序的 {image_id: meta}
+        修改时间和大小都没变的元数据直接取自 .meta_manifest.json，不再打开文件（网络盘上差别很大） """
+        manifest_path = os.path.join(self.path, MANIFEST_FILE)
+        try:
+            with open(manifest_path, "r", encoding="utf-8") as f:
+                cached = json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            cached = {}
+
+        def load(image_id):
+            path = os.path.join(self.path, image_id, META_FILE)
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError:
+                return image_id, None, False
+            key = [stat.st_mtime_ns, stat.st_size]
+            entry = cached.get(image_id)
+            if entry is not None and entry[:2] == key:
+                return image_id, entry, False
+            try:
+                with open(path, "r") as f:
+                    return image_id, key + [json.load(f)], True
+            except (json.JSONDecodeError, OSError) as e:
+                print(f"跳过无效元数据 {image_id}: {str(e)}")
+                return image_id, None, False
+
+        image_ids = [entry.name for entry in os.scandir(self.path) if entry.is_dir()]
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            results = list(pool.map(load, image_ids))
+        entries = {image_id: entry for image_id, entry, _ in results if entry is not None}
+        if any(changed for _, _, changed in results) or len(entries) != len(cached):
+            with open(manifest_path + ".tmp", "w", encoding="utf-8") as f:
+                json.dump(entries, f, separators=(",", ":"), ensure_ascii=False)
+            os.replace(manifest_path + ".tmp", manifest_path)
+        return {image_id: entries[image_id][2] for image_id in sorted(entries)}
+
+    def find(self, image_id, stem):
+        """ 按不带扩展名的文件名查找图片，如 find(image_id, "cap_full_image") """
+        for ext in IMAGE_EXTENSIONS:
+            if self.has(image_id, stem + ext):
+                return stem + ext
+        return None
+
+    def names(self, image_id):
+        """ 截图包含的文件名（不含元数据） """
+        return sorted(entry.name for entry in os.scandir(self.image_dir(image_id)) if entry.is_file() and entry.name != META_FILE)
+
+    def read_meta(self, image_id):
+        with open(os.path.join(self.path, image_id, META_FILE), "r") as f:
+            return json.load(f)
+
+    def write_meta(self, image_id, meta, indent=None):
+        os.makedirs(self.image_dir(image_id), exist_ok=True)
+        with open(os.path.join(self.path, image_id, META_FILE), "w") as f:
+            json.dump(meta, f, indent=indent)
+
+    def update_meta(self, image_id, updates):
+        """ 合并更新元数据字段，读改写期间持有跨进程锁，多个工具同时更新同一张截图时不会互相覆盖 """
+        with self._file_lock:
+            return self._merge_meta(image_id, updates)
+
+    def update_metas(self, updates):
+        """ 批量合并更新 {image_id: 字段}，整批只取一次锁 """
+        with self._file_lock:
+            for image_id, fields in updates.items():
+                self._merge_meta(image_id, fields)
+
+    def _merge_meta(self, image_id, updates):
+        meta = self.read_meta(image_id)
+        meta.update(updates)
+        self.write_meta(image_id, meta, indent=4)
+        return meta
+
+    def read_bytes(self, image_id, name):
+        with open(os.path.join(self.path, image_id, name), "rb") as f:
+            return f.read()
+
+    def version(self, image_id, name):
+        """ 图片内容的版本，重新写入后改变（预览金字塔据此判断是否过期） """
+        return file_version(os.path.join(self.path, image_id, name))
+
+    def write(self, image_id, blobs):
+        """ 写入 {文件名: 字节} """
+        image_dir = self.image_dir(image_id)
+        os.makedirs(image_dir, exist_ok=True)
+        for name, data in blobs.items():
+            with open(os.path.join(image_dir, name), "wb") as f:
+                f.write(data)
+
+    def open_image(self, image_id, name):
+        from PIL import Image
+        return Image.open(os.path.join(self.path, image_id, name))
+
+    def delete(self, image_id):
+        """ 删除一张截图的目录 """
+        shutil.rmtree(self.image_dir(image_id))
+
+    def close(self):
+        pass
+
+
+class PackSession:
+    """ 只追加的打包存储：图片数据追加到 session.pack，索引记录追加到 session.idx
+    索引每行是 {"id": ..., "blobs": {文件名: [偏移, 长度]}}、{"id": ..., "meta": {...}}、
+    {"id": ..., "patch": {字段}} 或 {"id": ..., "deleted": true}，同一 image_id 的多条记录按顺序合并，后写入的覆盖先写入的
+    update_meta 只追加修改的字段（patch），不同进程同时更新同一张截图的不同字段时不会互相覆盖 """
+
+    format = "pack"
+
+    def __init__(self, path):
+        self.path = path
+        os.makedirs(path, exist_ok=True)
+        self.pack_path = os.path.join(path, PACK_FILE)
+        self.index_path = os.path.join(path, INDEX_FILE)
+        self._lock = threading.Lock()
+        self._file_lock = FileLock(os.path.join(path, LOCK_FILE))  # 写入时与其他进程 / 实例互斥
+        self._pack = open(self.pack_path, "ab")
+        self._index = open(self.index_path, "ab")  # 每条记录编码后一次 write 写出
+        self._map = None
+        self._map_size = 0
+        self.records = {}  # image_id -> {"meta": dict | None, "blobs": {name: (offset, length)}}
+        self._index_offset = 0
+        self.refresh()
+
+    def refresh(self):
+        """ 读取索引文件中新追加的记录（其他进程可能还在写入） """
+        with self._lock, open(self.index_path, "r", encoding="utf-8") as f:
+            f.seek(self._index_offset)
+            while True:
+                line = f.readline()
+                if not line.endswith("\n"):
+                    break  # 尚未写完的最后一行下次再读
+                self._index_offset = f.tell()
+                try:
+                    entry = json.loads(line)
+                except json.JSONDecodeError as e:
+                    print(f"跳过损坏的索引记录 {self.index_path}: {e}")
+                    continue
+                self._apply(entry)
+
+    def _apply(self, entry):
+        if entry.get("deleted"):
+            self.records.pop(entry["id"], None)
+            return
+        record = self.records.setdefault(entry["id"], {"meta": None, "blobs": {}})
+        if "meta" in entry:
+            record["meta"] = dict(entry["meta"])
+        if "patch" in entry and record["meta"] is not None:
+            record["meta"].update(entry["patch"])
+        for name, (offset, length) in entry.get("blobs", {}).items():
+            record["blobs"][name] = (offset, length)
+
+    def _append_index(self, entry):
+        # 调用方持有 _lock 和 _file_lock；整行作为一次 write 写出并立即 flush
+        # （Windows 模拟的 O_APPEND 不是原子的，所以仍需要跨进程锁）
+        # 不移动 _index_offset：其他进程（如录制器）可能在这之前追加了记录，refresh 时按文件顺序重放，
+        # 自己写的记录再应用一次结果不变
+        self._index.write((json.dumps(entry, separators=(",", ":"), ensure_ascii=False) + "\n").encode("utf-8"))
+        self._index.flush()
+        self._apply(entry)
+
+    def image_ids(self):
+        with self._lock:
+            return sorted(image_id for image_id, record in self.records.items() if record["meta"] is not None)
+
+    def has(self, image_id, name):
+        return name in self.records.get(image_id, {}).get("blobs", {})
+
+    def metas(self, workers=None):
+        """ 元数据都在索引中，先读取其他进程新追加的记录，再返回 {image_id: meta} """
+        self.refresh()
+        with self._lock:
+            return {
+                image_id: dict(self.records[image_id]["meta"])
+                for image_id in sorted(self.records) if self.records[image_id]["meta"] is not None
+            }
+
+    def find(self, image_id, stem):
+        for ext in IMAGE_EXTENSIONS:
+            if self.has(image_id, stem + ext):
+                return stem + ext
+        return None
+
+    def names(self, image_id):
+        with self._lock:
+            return sorted(self.records[image_id]["blobs"])
+
+    def read_meta(self, image_id):
+        meta = self.records[image_id]["meta"]
+        if meta is None:
+            raise KeyError(image_id)
+        return dict(meta)
+
+    def write_meta(self, image_id, meta, indent=None):
+        with self._lock, self._file_lock:
+            self._append_index({"id": image_id, "meta": meta})
+
+    def update_meta(self, image_id, updates):
+        """ 追加只包含修改字段的 patch 记录，不基于本进程内存中可能过期的完整元数据 """
+        with self._lock, self._file_lock:
+            if image_id not in self.records:
+                raise KeyError(image_id)
+            self._append_index({"id": image_id, "patch": updates})
+            return dict(self.records[image_id]["meta"])
+
+    def update_metas(self, updates):
+        """ 批量合并更新 {image_id: 字段}，整批只取一次锁，每条 patch 记录仍然单独写出 """
+        with self._lock, self._file_lock:
+            for image_id, fields in updates.items():
+                if image_id not in self.records:
+                    raise KeyError(image_id)
+                self._append_index({"id": image_id, "patch": fields})
+
+    def write(self, image_id, blobs):
+        """ 图片数据先落盘，再写索引记录，中途崩溃只会留下没有索引的数据
+        其他进程 / 实例也可能追加 session.pack，所有图片一次写出，偏移量按写入后的文件末尾计算 """
+        data = b"".join(blobs.values())
+        with self._lock, self._file_lock:
+            self._pack.write(data)
+            self._pack.flush()
+            offset = os.fstat(self._pack.fileno()).st_size - len(data)
+            positions = {}
+            for name, blob in blobs.items():
+                positions[name] = [offset, len(blob)]
+                offset += len(blob)
+            self._append_index({"id": image_id, "blobs": positions})
+
+    def read_bytes(self, image_id, name):
+        offset, length = self.records[image_id]["blobs"][name]
+        with self._lock:
+            if offset + length > self._map_size:
+                self._remap()
+            return self._map[offset:offset + length]
+
+    def version(self, image_id, name):
+        """ 图片内容的版本 [偏移, 长度]，只追加写入，重新写入后偏移一定改变 """
+        return list(self.records[image_id]["blobs"][name])
+
+    def _remap(self):
+        self._pack.flush()
+        size = os.path.getsize(self.pack_path)
+        if self._map is not None:
+            self._map.close()
+        with open(self.pack_path, "rb") as f:
+            self._map = mmap.mmap(f.fileno(), size, access=mmap.ACCESS_READ) if size else None
+        self._map_size = size
+
+    def open_image(self, image_id, name):
+        from PIL import Image
+        return Image.open(io.BytesIO(self.read_bytes(image_id, name)))
+
+    def delete(self, image_id):
+        """ 追加删除记录；图片数据仍留在 session.pack 中，export 时不会导出 """
+        with self._lock, self._file_lock:
+            self._append_index({"id": image_id, "deleted": True})
+
+    def close(self):
+        with self._lock:
+            if self._map is not None:
+                self._map.close()
+                self._map = None
+            self._pack.close()
+            self._index.close()
+
+
+def open_session(path, storage_format=None):
+    """ 打开录制目录；未指定格式时存在 session.idx 即为 pack 格式 """
+    if storage_format is None:
+        storage_format = "pack" if os.path.exists(os.path.join(path, INDEX_FILE)) else "dir"
+    if storage_format == "pack":
+        return PackSession(path)
+    if storage_format == "dir":
+        return DirSession(path)
+    raise ValueError(f"未知的存储格式: {storage_format}")
+
+
+_worker_session = None
+
+
+def init_worker(app_dir):
+    """ 进程池的 initializer：每个工作进程只打开一次录制目录，之后用 worker_session() 取得
+    并行度由进程池提供，OpenCV 只用单线程 """
+    global _worker_session
+    import cv2
+    cv2.setNumThreads(1)
+    _worker_session = open_session(app_dir)
+
+
+def worker_session():
+    """ 当前进程中由 init_worker 打开的录制目录 """
+    return _worker_session
+
+
+def export_dirs(session, out_dir):
+    """ 把 pack 格式导出为每张截图一个目录的原有格式 """
+    target = DirSession(out_dir)
+    image_ids = session.image_ids()
+    for image_id in image_ids:
+        blobs = {name: session.read_bytes(image_id, name) for name in session.names(image_id)}
+        target.write(image_id, blobs)
+        target.write_meta(image_id, session.read_meta(image_id))
+    return len(image_ids)
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 3 or sys.argv[1] != "export":
+        print("用法: python session.py export [pack目录] [导出目录]")
+        sys.exit(1)
+    source = sys.argv[2]
+    target = sys.argv[3] if len(sys.argv) > 3 else source.rstrip("/\\") + "_export"
+    session = open_session(source, "pack")
+    print(f"已导出 {export_dirs(session, target)} 张截图到 {target}")
@@ -0,0 +1,207 @@
+import os
+import sys
+import queue
+import argparse
+import threading
+import multiprocessing as mp
+
+import keyboard
+import mouse
+
+from capture import SyntheticWindow, create_backend
+from writer import FrameWriter
+from scheduler import CaptureScheduler
+from session import open_session
+from upload import SessionUploader, create_store
+from run import AppUsageRecorder
+from config import clean_folder_name, load_config
+
+# 同时录制多个窗口 / 显示器
+# 每个目标在独立的进程中截图、去重（各自的去重历史）并编码，截图和编码可以利用多个 CPU 核；
+# 主进程只有一个调度器和键鼠钩子，触发时广播给所有目标，编码后的图片交给共用的写入线程池保存
+# writer_policy 只在目标进程中生效：目标进程已经记入去重历史和增量基准的截图，主进程不能再丢弃
+# 目标为 {"name": 保存目录名, "window": 窗口标题} 或 {"name": ..., "monitor": 显示器编号}
+
+
+def monitor_window(backend):
+    """ 把整个显示器当作窗口，应用截图即为全屏截图 """
+    x, y, width, height = backend.screen_area()
+    return SyntheticWindow(x, y, width, height, title="monitor")
+
+
+def default_backend(target, config):
+    """ 按配置为目标创建截图后端和窗口，返回 (backend, window) """
+    backend = create_backend(config["capture_backend"], target.get("monitor", config["capture_monitor"]))
+    window = target["window"] if "window" in target else monitor_window(backend)
+    return backend, window
+
+
+def record_target(target, config, commands, results, backend_factory=None):
+    """ 目标进程：收到触发原因就截图，编码后的图片发回主进程；收到 None 时退出 """
+    name = target["name"]
+    config = dict(config, upload_to_cloud=False, metrics_port=0)  # 上传由主进程负责；多个进程不能共用同一端口
+    recorder = None
+    stats = {"saved": 0}
+    try:
+        backend, window = (backend_factory or default_backend)(target, config)
+        recorder = AppUsageRecorder(
+            window, name, config, backend=backend, activate=False,  # 多个目标同时录制，不抢焦点
+            forward=lambda image_id, blobs, meta: results.put(("capture", name, image_id, blobs, meta))
+        )
+        recorder.start_metrics()
+        while True:
+            reason = commands.get()
+            if reason is None:
+                break
+            recorder.take_screenshot(f"[{name}] {reason}")
+    except Exception as e:
+        print(f"[{name}] 录制失败: {e}")
+    finally:
+        if recorder is not None:
+            recorder.close()
+            stats = {
+                "saved": recorder.collection_count,
+                "dedup": dict(recorder.dedup.stats),
+                "writer": dict(recorder.writer.stats)
+            }
+        results.put(("done", name, stats))  # 主进程据此判断目标进程已发完所有截图
+
+
+class RecordingSupervisor:
+    """ 为每个目标启动一个录制进程，共用调度器和写入线程池 """
+
+    def __init__(self, targets, config, backend_factory=None):
+        names = [target["name"] for target in targets]
+        if not targets or len(set(names)) != len(names):
+            raise ValueError(f"目标名称不能为空或重复: {names}")
+        self.targets = targets
+        self.config = config
+        self.backend_factory = backend_factory  # 需要能被子进程导入（模块级函数）
+        self.scheduler = CaptureScheduler(
+            config["auto_screenshot_interval"],
+            config["min_screenshot_interval"],
+            auto=config["capture_mode"] == "auto"
+        )
+        self.writer = FrameWriter(
+            self.save_capture,
+            workers=config["writer_workers"],
+            queue_size=config["writer_queue_size"] * len(targets),
+            policy="block"  # 队列满时阻塞接收线程，压力传回目标进程，由目标进程按 writer_policy 丢弃
+        )
+        self.sessions = {
+            name: open_session(os.path.join(config["base_save_path"], name), config["storage_format"])
+            for name in names
+        }
+        self.uploaders = {}
+        if config["upload_to_cloud"]:
+            store = create_store(config)
+            for name in names:
+                self.uploaders[name] = SessionUploader(
+                    self.sessions[name], store, name,
+                    workers=config["upload_workers"],
+                    max_retries=config["upload_max_retries"]
+                )
+                self.uploaders[name].start()
+        self.stats = {}  # 目标名称 -> 进程退出时汇报的统计
+
+        # spawn 在各平台行为一致，子进程各自创建截图后端（mss 等不能跨 fork 共用）
+        context = mp.get_context("spawn")
+        self.results = context.Queue(maxsize=config["writer_queue_size"] * len(targets))
+        self.commands = {name: context.Queue(maxsize=1) for name in names}
+        self.processes = [
+            context.Process(
+                target=record_target,
+                args=(target, config, self.commands[target["name"]], self.results, backend_factory),
+                name=f"recorder-{target['name']}",
+                daemon=True
+            )
+            for target in targets
+        ]
+        self._receiver = threading.Thread(target=self._receive, name="supervisor-receiver", daemon=True)
+
+    def save_capture(self, job):
+        """ 在写入线程中保存目标进程编码好的截图 """
+        name, image_id, blobs, meta = job
+        session = self.sessions[name]
+        session.write(image_id, blobs)
+        session.write_meta(image_id, meta)
+        if name in self.uploaders:
+            self.uploaders[name].enqueue(image_id)
+
+    def _receive(self):
+        running = len(self.processes)
+        while running:
+            message = self.results.get()
+            if message[0] == "done":
+                self.stats[message[1]] = message[2]
+                running -= 1
+            else:
+                self.writer.submit(message[1:])
+
+    def broadcast(self, reason):
+        """ 把触发原因发给所有目标；目标还在处理上一次触发时合并 """
+        for commands in self.commands.values():
+            try:
+                commands.put_nowait(reason)
+            except queue.Full:
+                pass
+
+    def start(self):
+        for process in self.processes:
+            process.start()
+        self._receiver.start()
+
+    def close(self):
+        """ 通知目标进程退出，保存完剩余截图后释放存储和上传器 """
+        for process, commands in zip(self.processes, self.commands.values()):
+            if process.is_alive():
+                commands.put(None)
+        self._receiver.join()
+        for process in self.processes:
+            process.join()
+        self.writer.close()
+        for name, uploader in self.uploaders.items():
+            uploader.close()
+            print(f"[{name}] 上传结果: {uploader.stats}")
+        for session in self.sessions.values():
+            session.close()
+
+    def run(self):
+        """ 在当前线程中调度截图，按 F10 停止 """
+        print(f"开始录制 {len(self.targets)} 个目标... 按 F10 停止录制")
+        self.start()
+        hooks = [
+            (keyboard.remove_hotkey, keyboard.add_hotkey("F10", self.scheduler.stop)),
+            (keyboard.unhook, keyboard.on_press_key("F9", lambda event: self.scheduler.trigger("手动截图"))),
+            (mouse.unhook, mouse.on_button(lambda: self.scheduler.trigger("鼠标活动"), types=(mouse.DOWN, mouse.UP)))
+        ]
+        try:
+            self.scheduler.run(self.broadcast)
+        finally:
+            for remove, hook in hooks:
+                remove(hook)
+            self.close()
+        for name, stats in self.stats.items():
+            print(f"[{name}] 保存 {stats['saved']} 张截图")
+        print("录制结束")
+
+
+def parse_target(text, key):
+    """ 解析 "窗口标题" / "显示器编号"，可以用 "=目录名" 指定保存目录 """
+    value, _, name = text.partition("=")
+    if key == "monitor":
+        return {"name": name or f"monitor_{value}", "monitor": int(value)}
+    return {"name": name or clean_folder_name(value), "window": value}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="同时录制多个窗口或显示器")
+    parser.add_argument("--window", action="append", default=[], help='窗口标题，可重复，如 --window "记事本=notepad"')
+    parser.add_argument("--monitor", action="append", default=[], help="显示器编号（mss 编号，1 为主显示器），可重复")
+    args = parser.parse_args()
+
+    targets = [parse_target(text, "window") for text in args.window] + [parse_target(text, "monitor") for text in args.monitor]
+    if not targets:
+        parser.print_help()
+        sys.exit(1)
+    RecordingSupervisor(targets, load_config()).run()
@@ -0,0 +1,206 @@
+import os
+import sys
+import json
+import time
+import queue
+import random
+import hashlib
+import argparse
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from config import load_config
+from session import META_FILE, open_session
+
+# 录制结果上传：后台线程池并行上传，失败按指数退避重试
+# 每个上传成功的文件追加到录制目录下的 .upload_journal.jsonl，重启后跳过已上传且未变化的文件
+# 录制器在写入线程写完截图后只做一次非阻塞的入队，不会卡住截图
+
+JOURNAL_FILE = ".upload_journal.jsonl"
+
+
+class AzureBlobStore:
+    """ Azure Blob 存储；整个上传器共用一个客户端和连接池，大文件按块并行上传 """
+
+    def __init__(self, account_url, container_name, max_concurrency=4):
+        from azure.storage.blob import BlobServiceClient
+        if "AccountKey=" in account_url or "UseDevelopmentStorage=" in account_url:
+            client = BlobServiceClient.from_connection_string(account_url)  # 连接字符串（如本地 Azurite 模拟器）
+        else:
+            client = BlobServiceClient(account_url=account_url)
+        self.container = client.get_container_client(container_name)
+        self.max_concurrency = max_concurrency
+
+    def upload(self, name, data):
+        self.container.upload_blob(name, data, overwrite=True, max_concurrency=self.max_concurrency)
+
+
+class LocalStore:
+    """ 用本地目录代替云存储，便于离线测试 """
+
+    def __init__(self, root):
+        self.root = root
+
+    def upload(self, name, data):
+        path = os.path.join(self.root, *name.split("/"))
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path + ".part", "wb") as f:
+            f.write(data)
+        os.replace(path + ".part", path)
+
+
+def create_store(config):
+    """ 根据配置创建上传目标，upload_local_dir 优先 """
+    if config["upload_local_dir"]:
+        return LocalStore(config["upload_local_dir"])
+    if not config["azure_sas_url"] or not config["container_name"]:
+        raise ValueError("未配置 azure_sas_url 或 container_name")
+    return AzureBlobStore(config["azure_sas_url"], config["container_name"], config["upload_block_concurrency"])
+
+
+class SessionUploader:
+    """ 把一个录制目录（dir 或 pack 格式）上传到 store，支持断点续传 """
+
+    def __init__(self, session, store, prefix, workers=4, max_retries=5, backoff=1.0):
+        self.session = session
+        self.store = store
+        self.prefix = prefix.strip("/")
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.journal_path = os.path.join(session.path, JOURNAL_FILE)
+        self.uploaded = self._load_journal()  # "image_id/文件名" -> 版本
+        self.stats = {"uploaded": 0, "skipped": 0, "failed": 0, "bytes": 0}
+        self._lock = threading.Lock()
+        self._pending = queue.Queue(maxsize=10000)
+        self._overflow = False  # 队列曾经满过，关闭时需要完整扫描一次
+        self._pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="uploader")
+        self._dispatcher = None
+
+    def _load_journal(self):
+        uploaded = {}
+        if os.path.exists(self.journal_path):
+            with open(self.journal_path, "r", encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except json.JSONDecodeError:
+                        continue  # 上次退出时没写完的行
+                    uploaded[entry["key"]] = entry["version"]
+        return uploaded
+
+    def _record(self, key, version, size):
+        with self._lock:
+            self.uploaded[key] = version
+            self.stats["uploaded"] += 1
+            self.stats["bytes"] += size
+            with open(self.journal_path, "a", encoding="utf-8") as f:
+                f.write(json.dumps({"key": key, "version": version, "time": time.time()}) + "\n")
+
+    def _count(self, key):
+        with self._lock:
+            self.stats[key] += 1
+
+    def _items(self, image_id):
+        """ 返回 (文件名, 版本, 读取函数)；版本变化（如裁剪后元数据更新）时重新上传 """
+        items = []
+        if self.session.format == "dir":
+            for name in self.session.names(image_id) + [META_FILE]:
+                path = os.path.join(self.session.image_dir(image_id), name)
+                stat = os.stat(path)
+                items.append((name, f"{stat.st_size}:{stat.st_mtime_ns}",
+                              lambda image_id=image_id, name=name: self.session.read_bytes(image_id, name)))
+        else:
+            for name in self.session.names(image_id):
+                offset, length = self.session.records[image_id]["blobs"][name]
+                items.append((name, f"{offset}:{length}",
+                              lambda image_id=image_id, name=name: self.session.read_bytes(image_id, name)))
+            meta = json.dumps(self.session.read_meta(image_id), indent=4).encode("utf-8")
+            items.append((META_FILE, hashlib.md5(meta).hexdigest(), lambda meta=meta: meta))
+        return items
+
+    def _upload_one(self, key, version, read):
+        data = read()
+        for attempt in range(self.max_retries + 1):
+            try:
+                self.store.upload(f"{self.prefix}/{key}", data)
+                self._record(key, version, len(data))
+                return True
+            except Exception as e:
+                if attempt == self.max_retries:
+                    print(f"上传失败 {key}: {e}")
+                    self._count("failed")
+                    return False
+                time.sleep(self.backoff * 2 ** attempt * (0.5 + random.random()))  # 指数退避 + 抖动
+
+    def upload_image(self, image_id):
+        """ 提交一张截图中尚未上传的文件，返回 Future 列表 """
+        futures = []
+        for name, version, read in self._items(image_id):
+            key = f"{image_id}/{name}"
+            if self.uploaded.get(key) == version:
+                self._count("skipped")
+                continue
+            futures.append(self._pool.submit(self._upload_one, key, version, read))
+        return futures
+
+    def sync(self):
+        """ 上传录制目录中所有尚未上传的文件并等待完成 """
+        futures = []
+        for image_id in self.session.image_ids():
+            futures.extend(self.upload_image(image_id))
+        for future in futures:
+            future.result()
+
+    def enqueue(self, image_id):
+        """ 非阻塞入队，队列满时在关闭时补做完整扫描 """
+        try:
+            self._pending.put_nowait(image_id)
+        except queue.Full:
+            self._overflow = True
+
+    def start(self):
+        """ 启动后台分发线程，消费 enqueue 的截图 """
+        def dispatch():
+            while True:
+                image_id = self._pending.get()
+                if image_id is None:
+                    return
+                try:
+                    self.upload_image(image_id)
+                except Exception as e:
+                    print(f"上传任务提交失败 {image_id}: {e}")
+
+        self._dispatcher = threading.Thread(target=dispatch, name="upload-dispatcher", daemon=True)
+        self._dispatcher.start()
+
+    def close(self):
+        """ 上传完队列中剩余的截图后停止 """
+        if self._dispatcher is not None:
+            self._pending.put(None)
+            self._dispatcher.join()
+        if self._overflow:
+            self.sync()
+        self._pool.shutdown(wait=True)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="上传已有的录制目录（支持断点续传）")
+    parser.add_argument("session_dir", help="录制目录，即 ./[base_save_path]/[app_name]")
+    parser.add_argument("--prefix", help="云端路径前缀，默认使用目录名")
+    args = parser.parse_args()
+
+    config = load_config()
+    session = open_session(args.session_dir)
+    prefix = args.prefix or os.path.basename(os.path.normpath(args.session_dir))
+    uploader = SessionUploader(
+        session,
+        create_store(config),
+        prefix,
+        workers=config["upload_workers"],
+        max_retries=config["upload_max_retries"]
+    )
+    uploader.sync()
+    uploader.close()
+    session.close()
+    print(f"上传完成: {uploader.stats}")
+    sys.exit(1 if uploader.stats["failed"] else 0)
@@ -0,0 +1,74 @@
+import queue
+import threading
+
+# 后台编码写盘：截图线程只负责截图和去重，编码、建目录和写元数据交给写入线程池
+# cv2.imencode / 文件写入会释放 GIL，多个线程可以并行编码
+
+POLICIES = ("block", "drop")
+_STOP = object()
+
+
+class FrameWriter:
+    """ 有界队列 + 写入线程池，队列满时按 policy 阻塞或丢弃 """
+
+    def __init__(self, handler, workers=2, queue_size=8, policy="block"):
+        if policy not in POLICIES:
+            raise ValueError(f"未知的写入策略: {policy}")
+        self.handler = handler  # 在写入线程中执行 handler(job)
+        self.policy = policy
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.stats = {"submitted": 0, "written": 0, "dropped": 0, "failed": 0}
+        self._lock = threading.Lock()
+        self._threads = [
+            threading.Thread(target=self._worker, name=f"frame-writer-{i}", daemon=True)
+            for i in range(max(1, workers))
+        ]
+        for thread in self._threads:
+            thread.start()
+
+    def _count(self, key):
+        with self._lock:
+            self.stats[key] += 1
+
+    def _worker(self):
+        while True:
+            job = self.queue.get()
+            try:
+                if job is _STOP:
+                    return
+                self.handler(job)
+                self._count("written")
+            except Exception as e:
+                print(f"截图写入失败: {e}")
+                self._count("failed")
+            finally:
+                self.queue.task_done()
+
+    def submit(self, job):
+        """ 提交写入任务，drop 策略下队列已满时丢弃并返回 False """
+        if self.policy == "block":
+            self.queue.put(job)
+        else:
+            try:
+                self.queue.put_nowait(job)
+            except queue.Full:
+                self._count("dropped")
+                return False
+        self._count("submitted")
+        return True
+
+    def depth(self):
+        """ 当前排队的任务数 """
+        return self.queue.qsize()
+
+    def flush(self):
+        """ 等待已提交的任务全部写完 """
+        self.queue.join()
+
+    def close(self):
+        """ 写完剩余任务并停止写入线程 """
+        self.flush()
+        for _ in self._threads:
+            self.queue.put(_STOP)
+        for thread in self._threads:
+            thread.join()